@@ -0,0 +1,131 @@
+# Generates synthetic order book files in the HDF5 layout that data_import.py reads:
+# one group per trading day, each holding the ORDERS, CANCELS and TRADES tables
+import argparse
+import calendar
+from datetime import datetime, timedelta
+
+import h5py
+import numpy as np
+
+from sparkles.modules.utils.tables import SCHEMA_STRINGS, LONG_FIELDS  # The columns of the tables, the LONG_FIELDS are epoch milliseconds
+
+BUY = 66
+SELL = 83
+
+START_DATE = '2012-10-01'
+SESSION_OPEN = 9 * 3600 * 1000  # Milliseconds after midnight UTC
+SESSION_CLOSE = 17 * 3600 * 1000 + 30 * 60 * 1000
+
+# Named scales: number of trading days, orders on an average day and order books
+SCALES = {
+    'tiny': (2, 10000, 5),
+    'small': (5, 100000, 20),
+    'medium': (10, 1000000, 50),
+    'large': (20, 5000000, 200)
+}
+
+
+def table_dtype(table):
+
+    return [(name, '<i8' if name in LONG_FIELDS[table] else '<i4') for name in SCHEMA_STRINGS[table].split()]
+
+
+# Day sizes vary like real trading days, one busy day is several times larger than the quiet ones
+def day_sizes(days, orders_per_day, rng):
+
+    weights = rng.uniform(0.2, 1.5, days)
+    weights[rng.randint(days)] *= 5
+    weights = weights / weights.mean()
+    return [max(int(orders_per_day * w), 1) for w in weights]
+
+
+def generate_day(day_start, n, books, first_id, rng):
+
+    ''' Returns the ORDERS, CANCELS and TRADES arrays of one trading day with n orders.
+    About a third of the orders stay alive until the close (destroyed is 0), the others are cancelled or traded.
+    '''
+
+    orders = np.zeros(n, dtype=table_dtype('ORDERS'))
+    orders['id'] = np.arange(first_id, first_id + n)
+    orders['ref'] = orders['id']
+    orders['ob_id'] = rng.randint(0, books, n)
+    orders['created'] = np.sort(day_start + rng.randint(SESSION_OPEN, SESSION_CLOSE, n))
+    orders['side'] = np.where(rng.rand(n) < 0.5, BUY, SELL)
+
+    mid_price = 10000 + orders['ob_id'] * 100
+    offset = rng.geometric(0.2, n)  # Most orders sit close to the middle of the book
+    orders['price'] = np.where(orders['side'] == BUY, mid_price - offset, mid_price + offset)
+    orders['quantity'] = rng.randint(1, 1000, n)
+
+    lifetime = rng.exponential(60000, n).astype(np.int64) + 1
+    destroyed = np.minimum(orders['created'] + lifetime, day_start + SESSION_CLOSE)
+    fate = rng.rand(n)
+    orders['destroyed'] = np.where(fate < 0.33, 0, destroyed)
+
+    cancelled = orders[(fate >= 0.33) & (fate < 0.8)]
+    cancels = np.zeros(len(cancelled), dtype=table_dtype('CANCELS'))
+    for name in ['id', 'ob_id', 'side', 'price', 'quantity']:
+        cancels[name] = cancelled[name]
+    cancels['timestamp'] = cancelled['destroyed']
+    cancels = cancels[np.argsort(cancels['timestamp'], kind='mergesort')]
+
+    traded = orders[fate >= 0.8]
+    trades = np.zeros(len(traded), dtype=table_dtype('TRADES'))
+    trades['id'] = np.arange(len(traded)) + first_id
+    trades['o_id'] = traded['id']
+    for name in ['ob_id', 'side', 'price', 'quantity']:
+        trades[name] = traded[name]
+    trades['timestamp'] = traded['destroyed']
+    trades = trades[np.argsort(trades['timestamp'], kind='mergesort')]
+
+    return orders, cancels, trades
+
+
+def generate_file(filepath, days, orders_per_day, books, start_date=START_DATE, seed=0):
+
+    ''' Writes a synthetic HDF5 file and returns the number of rows written per table '''
+
+    rng = np.random.RandomState(seed)
+    first_day = datetime.strptime(start_date, '%Y-%m-%d')
+    counts = {'ORDERS': 0, 'CANCELS': 0, 'TRADES': 0}
+
+    with h5py.File(filepath, 'w') as f:
+        first_id = 0
+        for index, n in enumerate(day_sizes(days, orders_per_day, rng)):
+            day = first_day + timedelta(days=index)
+            day_start = calendar.timegm(day.timetuple()) * 1000
+            orders, cancels, trades = generate_day(day_start, n, books, first_id, rng)
+            first_id += n
+
+            group = f.create_group(day.strftime('%Y-%m-%d'))
+            for table, data in (('ORDERS', orders), ('CANCELS', cancels), ('TRADES', trades)):
+                group.create_dataset(table, data=data)
+                counts[table] += len(data)
+
+    return counts
+
+
+def format_counts(counts):
+
+    return ', '.join(table + ' ' + str(counts[table]) for table in sorted(counts))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Generate a synthetic order book HDF5 file')
+    parser.add_argument('filepath', type=str)
+    parser.add_argument('--scale', choices=sorted(SCALES.keys()), default='small')
+    parser.add_argument('--days', type=int)
+    parser.add_argument('--orders-per-day', type=int)
+    parser.add_argument('--books', type=int)
+    parser.add_argument('--start-date', type=str, default=START_DATE)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    days, orders_per_day, books = SCALES[args.scale]
+    counts = generate_file(args.filepath, args.days or days, args.orders_per_day or orders_per_day, args.books or books, args.start_date, args.seed)
+    print(args.filepath + ': ' + format_counts(counts))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+# Benchmark reader of a liquidity curve featureset: the total depth of every side within a price band,
+# the kind of query run on the curves afterwards. It reads any of the curve formats of liq_curve_parquet.py
+from pyspark import SparkConf, SparkContext
+from pyspark.sql import SQLContext
+import os
+import json
+import argparse
+from sparkles.modules.utils.depth import SIDES, decode_prices
+
+
+# The depth within the band of one side of a timestamp from its prices and depths
+def band_depth(prices, depths, price_min, price_max):
+
+    return sum(depth for price, depth in zip(prices, depths) if price_min <= price <= price_max)
+
+
+def module_implementation(sc, sqlContext, params=None, inputs=None, features=None):
+
+    ''' params: price_min, price_max and delta_prices when the prices of a parallel featureset are delta encoded '''
+
+    price_min = int(params['price_min'])
+    price_max = int(params['price_max'])
+    delta_prices = bool(params.get('delta_prices', False))
+
+    df = sqlContext.read.parquet(str(inputs[0]))
+
+    if('depth' in df.columns):  # Long format, the band is a filter on the price column
+        df.registerTempTable('CURVES')
+        rows = sqlContext.sql("SELECT side, SUM(depth) AS depth FROM CURVES WHERE price >=" + str(price_min) + " AND price <=" + str(price_max) + " GROUP BY side").collect()
+        totals = [0, 0]
+        for row in rows:
+            totals[SIDES[row.side]] = row.depth
+
+    elif('buy_price' in df.columns):
+        decode = decode_prices if delta_prices else list
+        totals = df.map(lambda x: (band_depth(decode(x.buy_price), x.buy_depth, price_min, price_max), band_depth(decode(x.sell_price), x.sell_depth, price_min, price_max))).\
+            reduce(lambda a, b: (a[0] + b[0], a[1] + b[1]))
+
+    else:
+        totals = df.map(lambda x: (band_depth([p[0] for p in x.curve_buy], [p[1] for p in x.curve_buy], price_min, price_max), band_depth([p[0] for p in x.curve_sell], [p[1] for p in x.curve_sell], price_min, price_max))).\
+            reduce(lambda a, b: (a[0] + b[0], a[1] + b[1]))
+
+    print('Depth within ' + str(price_min) + '-' + str(price_max) + ': buy ' + str(totals[0]) + ', sell ' + str(totals[1]))
+    return totals
+
+
+def main():
+    conf = SparkConf()
+    conf.setAppName("Read Curves Benchmark")
+    sc = SparkContext(conf=conf)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("backend", type=str)
+    parser.add_argument("helperpath", type=str)
+    parser.add_argument("shuffle_partitions", type=str)
+    parser.add_argument("params", type=str)
+    parser.add_argument("inputs", type=str)
+    parser.add_argument("features", type=str, nargs='?')
+
+    args = parser.parse_args()
+
+    params = json.loads(args.params)
+    inputs = json.loads(args.inputs)
+
+    sqlContext = SQLContext(sc)
+    sqlContext.setConf("spark.sql.shuffle.partitions", args.shuffle_partitions)
+
+    module_implementation(sc, sqlContext, params=params, inputs=inputs)
+
+    sc.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,346 @@
+# End to end benchmarks: imports a synthetic order book file with each write profile and runs the analysis modules on it
+# Every step records wall time, rows per second, shuffle bytes (from the Spark event log) and the peak memory of the
+# Spark processes. The results are appended to a JSON lines file and compared with the previous run of the same step
+import argparse
+import json
+import os
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from multiprocessing import Process, Queue
+from os.path import dirname
+
+import yaml
+
+from generate_data import SCALES, START_DATE, SESSION_OPEN, generate_file, format_counts
+from sparkles.modules.utils import runner as runner_module
+from sparkles.modules.utils.runner import SparkRunner
+from sparkles.modules.utils.models import Dataset, Analysis
+
+MODULES_PATH = dirname(dirname(os.path.abspath(runner_module.__file__)))
+REPO_PATH = dirname(dirname(os.path.abspath(__file__)))
+
+# Analyses that are timed after each import: module file, input table and the run parameters
+# The liquidity curves are written in each curve format to compare their storage size and read speed
+ANALYSES = [
+    ('event_count', os.path.join(MODULES_PATH, 'event_count_parquet.py'), 'ORDERS', {'interval': 1000}),
+    ('liq_curve', os.path.join(MODULES_PATH, 'liq_curve_parquet.py'), 'ORDERS', {'interval': 60000}),
+    ('liq_curve_parallel', os.path.join(MODULES_PATH, 'liq_curve_parquet.py'), 'ORDERS', {'interval': 60000, 'curve_format': 'parallel', 'delta_prices': True}),
+    ('liq_curve_long', os.path.join(MODULES_PATH, 'liq_curve_parquet.py'), 'ORDERS', {'interval': 60000, 'curve_format': 'long'})
+]
+
+# Reads of the featuresets written by the analyses: step name, module file, analysis and the run parameters
+READ_MODULE = os.path.join(dirname(os.path.abspath(__file__)), 'read_curves.py')
+READS = [
+    ('read_liq_curve', READ_MODULE, 'liq_curve', {'price_min': 10000, 'price_max': 10100}),
+    ('read_liq_curve_parallel', READ_MODULE, 'liq_curve_parallel', {'price_min': 10000, 'price_max': 10100, 'delta_prices': True}),
+    ('read_liq_curve_long', READ_MODULE, 'liq_curve_long', {'price_min': 10000, 'price_max': 10100})
+]
+
+
+def version_stamp():
+
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=REPO_PATH).strip().decode('utf-8')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def write_config(workdir, pyspark, cluster_url, shuffle_partitions, import_partitions, profiles):
+
+    ''' Writes a config for the nfs backend which keeps the metadata, modules and datasets under workdir '''
+
+    for name in ['mods', 'files', 'features', 'events', 'conf']:
+        if(not os.path.exists(os.path.join(workdir, name))):
+            os.makedirs(os.path.join(workdir, name))
+
+    metadata_path = os.path.join(workdir, 'sqlite.db')
+    config = {
+        'BACKEND': 'nfs',
+        'CLUSTER_URL': cluster_url,
+        'PYSPARK_CLIENT_PATH': pyspark,
+        'METADATA_URI': 'sqlite:///' + metadata_path,
+        'METADATA_LOCAL_PATH': metadata_path,
+        'BACKUP_METADATA_LOCAL_PATH': metadata_path + '.bak',
+        'MODULES_DIR': os.path.join(workdir, 'mods') + '/',
+        'MODULES_DIR_LOCAL': os.path.join(workdir, 'mods') + '/',
+        'FILES_DIR': os.path.join(workdir, 'files') + '/',
+        'FEATURES_DIR': os.path.join(workdir, 'features') + '/',
+        'HADOOP_RPC_PORT': 8020,
+        'SHUFFLE_PARTITIONS': shuffle_partitions,
+        'IMPORT_PARTITIONS': import_partitions,
+        'IMPORT_PROFILES': profiles
+    }
+
+    configpath = os.path.join(workdir, 'config.yml')
+    with open(configpath, 'w') as config_file:
+        yaml.safe_dump(config, config_file, default_flow_style=False)
+    return configpath
+
+
+# Spark reads spark-defaults.conf from SPARK_CONF_DIR, the existing defaults are kept and the event log is switched on
+def enable_event_log(workdir):
+
+    confdir = os.path.join(workdir, 'conf')
+    original_confdir = os.environ.get('SPARK_CONF_DIR') or os.path.join(os.environ.get('SPARK_HOME', ''), 'conf')
+    lines = []
+    defaults = os.path.join(original_confdir, 'spark-defaults.conf')
+    if(os.path.exists(defaults)):
+        with open(defaults) as defaults_file:
+            lines = [line for line in defaults_file.read().splitlines() if not line.startswith('spark.eventLog')]
+
+    lines.append('spark.eventLog.enabled true')
+    lines.append('spark.eventLog.dir file://' + os.path.join(workdir, 'events'))
+    with open(os.path.join(confdir, 'spark-defaults.conf'), 'w') as defaults_file:
+        defaults_file.write('\n'.join(lines) + '\n')
+
+    if(os.path.isdir(original_confdir)):
+        for name in os.listdir(original_confdir):  # log4j and spark-env settings still apply
+            if(name != 'spark-defaults.conf' and not os.path.exists(os.path.join(confdir, name))):
+                shutil.copy(os.path.join(original_confdir, name), confdir)
+
+    os.environ['SPARK_CONF_DIR'] = confdir
+
+
+# Sums the shuffle metrics of all the task end events of the applications logged after the step started
+def shuffle_bytes(eventdir, known_logs):
+
+    written = 0
+    read = 0
+    for name in sorted(set(os.listdir(eventdir)) - known_logs):
+        path = os.path.join(eventdir, name)
+        logfiles = [os.path.join(path, f) for f in os.listdir(path) if f.startswith('EVENT_LOG')] if os.path.isdir(path) else [path]
+        for logfile in logfiles:
+            with open(logfile) as log:
+                for line in log:
+                    event = json.loads(line)
+                    if(event.get('Event') != 'SparkListenerTaskEnd'):
+                        continue
+                    metrics = event.get('Task Metrics') or {}
+                    written += (metrics.get('Shuffle Write Metrics') or {}).get('Shuffle Bytes Written', 0)
+                    read_metrics = metrics.get('Shuffle Read Metrics') or {}
+                    read += read_metrics.get('Remote Bytes Read', 0) + read_metrics.get('Local Bytes Read', 0)
+
+    return written, read
+
+
+def directory_size(path):
+
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def run_step(queue, configpath, step, kwargs):
+
+    ''' Runs one SparkRunner call in a separate process so that the peak memory of its Spark processes can be told apart '''
+
+    sr = SparkRunner(configpath)
+    exit_code = getattr(sr, step)(**kwargs)
+    if(exit_code):  # run_analysis returns the exit code of pyspark
+        raise RuntimeError(step + " exited with " + str(exit_code))
+    queue.put(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+
+def timed_step(configpath, eventdir, step, **kwargs):
+
+    known_logs = set(os.listdir(eventdir))
+    queue = Queue()
+    started = time.time()
+    p = Process(target=run_step, args=(queue, configpath, step, kwargs))
+    p.start()
+    p.join()
+    wall_time = time.time() - started
+
+    if(p.exitcode != 0):
+        raise RuntimeError("Benchmark step " + step + " failed")
+
+    written, read = shuffle_bytes(eventdir, known_logs)
+    return {'wall_time': wall_time, 'shuffle_write_bytes': written, 'shuffle_read_bytes': read, 'peak_memory_kb': queue.get()}
+
+
+def find_dataset(configpath, name):
+
+    sr = SparkRunner(configpath)
+    return sr.session.query(Dataset).filter_by(name=name).first()
+
+
+def data_file(datadir, scale, seed):
+
+    ''' Generates the input file of the scale once and reuses it, the row counts are kept next to it '''
+
+    filepath = os.path.join(datadir, 'bench_' + scale + '_' + str(seed) + '.h5')
+    countspath = filepath + '.json'
+    if(not os.path.exists(countspath)):
+        days, orders_per_day, books = SCALES[scale]
+        counts = generate_file(filepath, days, orders_per_day, books, seed=seed)
+        with open(countspath, 'w') as counts_file:
+            json.dump(counts, counts_file)
+
+    with open(countspath) as counts_file:
+        counts = json.load(counts_file)
+    print('Input ' + filepath + ': ' + format_counts(counts))
+    return filepath, counts
+
+
+def epoch_to_param(ms):
+
+    return datetime.utcfromtimestamp(ms // 1000).strftime('%Y-%m-%d_%H:%M:%S') + '.%03d' % (ms % 1000)
+
+
+def benchmark_profile(configpath, workdir, filepath, counts, profile, run_id, window):
+
+    ''' Imports the file with the write profile and runs the analyses on the imported ORDERS table '''
+
+    eventdir = os.path.join(workdir, 'events')
+    identifier = os.path.splitext(os.path.basename(filepath))[0] + '_' + profile
+    linkpath = os.path.join(workdir, identifier + '.h5')  # The dataset names come from the file name
+    if(not os.path.exists(linkpath)):
+        os.symlink(os.path.abspath(filepath), linkpath)
+
+    results = []
+    total_rows = sum(counts.values())
+    result = timed_step(configpath, eventdir, 'import_dataset', inputfiles=[linkpath], description='benchmark', details=profile, profile=profile if profile != 'default' else None)
+    if(find_dataset(configpath, identifier + '_ORDERS') is None):
+        raise RuntimeError("Import with profile " + profile + " did not register the datasets")
+    result.update({'step': 'import', 'rows': total_rows, 'storage_bytes': directory_size(os.path.join(workdir, 'files', identifier))})
+    results.append(result)
+
+    featuresets = {}
+    for name, modulefile, table, params in ANALYSES:
+        params = dict(params)
+        params['start_time'] = epoch_to_param(window[0])
+        params['end_time'] = epoch_to_param(window[1])
+        featureset_name = identifier + '_' + name + '_' + run_id
+        features = {'description': 'benchmark', 'details': profile, 'featureset_name': featureset_name}
+        result = timed_step(configpath, eventdir, 'run_analysis', modulename='bench_' + name, params=params, inputs=[identifier + '_' + table], features=features, force=True)  # Timed also when the workdir has the featureset
+        featureset = find_dataset(configpath, featureset_name)
+        if(featureset is None):
+            raise RuntimeError("Analysis " + name + " with profile " + profile + " did not save its featureset")
+        result.update({'step': name, 'rows': counts[table], 'storage_bytes': directory_size(featureset.filepath.replace('file://', '', 1))})
+        results.append(result)
+        featuresets[name] = (featureset_name, counts[table])
+
+    for name, modulefile, analysis, params in READS:
+        featureset_name, rows = featuresets[analysis]
+        result = timed_step(configpath, eventdir, 'run_analysis', modulename='bench_' + name, params=dict(params), inputs=[featureset_name])
+        result.update({'step': name, 'rows': rows})
+        results.append(result)
+
+    for result in results:
+        result['profile'] = profile
+        result['rows_per_sec'] = result['rows'] / result['wall_time'] if result['wall_time'] else None
+
+    return results
+
+
+def load_results(resultspath):
+
+    if(not os.path.exists(resultspath)):
+        return []
+    with open(resultspath) as results_file:
+        return [json.loads(line) for line in results_file if line.strip()]
+
+
+def compare(results, previous, tolerance, baseline=None):
+
+    ''' Compares each result with the latest earlier run of the same scale, profile and step
+    (or with the latest run of the baseline version) and returns the steps which got slower than the tolerance allows
+    '''
+
+    regressions = []
+    for result in results:
+        key = (result['scale'], result['profile'], result['step'])
+        candidates = [r for r in previous if (r['scale'], r['profile'], r['step']) == key and (baseline is None or r['version'] == baseline)]
+        if(not candidates):
+            print('%-10s %-10s %-12s %10.1f s  (no baseline)' % (key + (result['wall_time'],)))
+            continue
+
+        base = candidates[-1]
+        ratio = result['wall_time'] / base['wall_time'] if base['wall_time'] else 1.0
+        flag = ''
+        if(ratio > 1.0 + tolerance):
+            flag = '  REGRESSION'
+            regressions.append((key, base['version'], ratio))
+        print('%-10s %-10s %-12s %10.1f s  %5.2fx of %s%s' % (key + (result['wall_time'], ratio, base['version'], flag)))
+
+    return regressions
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Run the end to end import and analysis benchmarks')
+    parser.add_argument('--scale', choices=sorted(SCALES.keys()), action='append')
+    parser.add_argument('--profile', action='append', help="Write profile name in the profiles file, 'default' for none")
+    parser.add_argument('--profiles-file', type=str, help='YAML file of write profiles, the same format as IMPORT_PROFILES')
+    parser.add_argument('--pyspark', type=str, default=os.path.join(os.environ.get('SPARK_HOME', ''), 'bin', 'pyspark'))
+    parser.add_argument('--master', type=str, default='local[*]')
+    parser.add_argument('--shuffle-partitions', type=int, default=8)
+    parser.add_argument('--import-partitions', type=int, default=8)
+    parser.add_argument('--workdir', type=str, help='Kept after the run when given')
+    parser.add_argument('--datadir', type=str, help='Where the generated input files are cached, the workdir by default')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--window-hours', type=float, default=1.0, help='Length of the analysed window from the first session open')
+    parser.add_argument('--results', type=str, default=os.path.join(dirname(os.path.abspath(__file__)), 'results.jsonl'))
+    parser.add_argument('--baseline', type=str, help='Version to compare against, the previous run by default')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed slowdown before a step counts as a regression')
+    args = parser.parse_args()
+
+    profiles = {}
+    if(args.profiles_file):
+        with open(args.profiles_file) as profiles_file:
+            profiles = yaml.safe_load(profiles_file) or {}
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='sparkles_bench_')
+    datadir = args.datadir or workdir
+    configpath = write_config(workdir, args.pyspark, args.master, args.shuffle_partitions, args.import_partitions, profiles)
+    enable_event_log(workdir)
+
+    sr = SparkRunner(configpath)
+    for name, modulefile, table, params in ANALYSES:
+        if(sr.session.query(Analysis).filter_by(name='bench_' + name).first() is None):
+            sr.import_analysis(name='bench_' + name, description='benchmark', details='', filepath=modulefile, params='start_time end_time ' + ' '.join(sorted(params)), inputs=table, outputs='featureset')
+    for name, modulefile, analysis, params in READS:
+        if(sr.session.query(Analysis).filter_by(name='bench_' + name).first() is None):
+            sr.import_analysis(name='bench_' + name, description='benchmark', details='', filepath=modulefile, params=' '.join(sorted(params)), inputs='featureset', outputs='')
+
+    version = version_stamp()
+    run_id = datetime.utcnow().strftime('%Y%m%d%H%M%S')
+    previous = load_results(args.results)
+    results = []
+
+    try:
+        for scale in args.scale or ['small']:
+            filepath, counts = data_file(datadir, scale, args.seed)
+            first_day = datetime.strptime(START_DATE, '%Y-%m-%d')
+            start = int((first_day - datetime(1970, 1, 1)).total_seconds()) * 1000 + SESSION_OPEN
+            window = (start, start + int(args.window_hours * 3600 * 1000))
+
+            for profile in args.profile or ['default']:
+                for result in benchmark_profile(configpath, workdir, filepath, counts, profile, run_id, window):
+                    result.update({'scale': scale, 'version': version, 'run_id': run_id, 'host': socket.gethostname(), 'master': args.master})
+                    results.append(result)
+    finally:
+        if(results):
+            with open(args.results, 'a') as results_file:
+                for result in results:
+                    results_file.write(json.dumps(result, sort_keys=True) + '\n')
+        if(not args.workdir):
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    regressions = compare(results, previous, args.tolerance, args.baseline)
+    if(regressions):
+        for key, base_version, ratio in regressions:
+            print('Regression: ' + ' '.join(key) + ' is %.2fx slower than %s' % (ratio, base_version))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+# Runs one analysis module several times in one Spark application (SparkRunner.run_analysis_batch)
+# The input datasets are read and cached once, and every run gets the same arguments as the main of the module would
+from pyspark import SparkConf, SparkContext
+from pyspark.sql import SQLContext
+import os
+import re
+import imp
+import json
+import argparse
+import traceback
+from sparkles.modules.utils.helper import configure_backend, ship_modules, ANALYSIS_MODULES
+
+
+def load_module(modulepath):
+
+    modulename = 'sparkles_analysis_' + re.sub(r'\W', '_', os.path.splitext(os.path.basename(modulepath))[0])
+    module = imp.load_source(modulename, modulepath)
+    if(not hasattr(module, 'module_implementation')):
+        raise RuntimeError("Module " + modulepath + " has no module_implementation")
+    return module
+
+
+# Runs every (params, features) pair and returns the indexes of the runs which failed, a failed run does not stop the others
+def run_batch(sc, sqlContext, module, runs, inputs):
+
+    failed = []
+    for index, (params, features) in enumerate(runs):
+        try:
+            module.module_implementation(sc, sqlContext, params=params, inputs=inputs, features=features or {})
+        except Exception:
+            traceback.print_exc()
+            failed.append(index)
+    return failed
+
+
+def main():
+    conf = SparkConf()
+    conf.setAppName("Batch Analysis")
+    conf.set("spark.jars", "file:/shared_data/spark_jars/hadoop-openstack-3.0.0-SNAPSHOT.jar")
+    sc = SparkContext(conf=conf)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("backend", type=str)
+    parser.add_argument("helperpath", type=str)
+    parser.add_argument("shuffle_partitions", type=str)
+    parser.add_argument("modulepath", type=str)
+    parser.add_argument("runs", type=str)
+    parser.add_argument("inputs", type=str)
+
+    args = parser.parse_args()
+
+    configure_backend(sc, args.backend)
+
+    helperpath = args.helperpath
+    sc.addFile(helperpath + "/utils/helper.py")  # To import custom modules
+    ship_modules(sc, helperpath, 'sparkles.modules.utils', ANALYSIS_MODULES)  # The mains of the modules are not run in a batch
+
+    runs = json.loads(args.runs)
+    inputs = json.loads(args.inputs)
+
+    sqlContext = SQLContext(sc)
+    sqlContext.setConf("spark.sql.shuffle.partitions", args.shuffle_partitions)
+
+    # The modules read their inputs from the same paths, which Spark answers from the cached data
+    cached = []
+    for filepath in inputs:
+        dataframe = sqlContext.read.parquet(str(filepath))
+        dataframe.cache()
+        dataframe.count()
+        cached.append(dataframe)
+
+    failed = run_batch(sc, sqlContext, load_module(args.modulepath), runs, inputs)
+
+    for dataframe in cached:
+        dataframe.unpersist()
+    sc.stop()
+
+    if(failed):
+        raise RuntimeError("Runs " + ', '.join(str(index) for index in failed) + " of the batch failed")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,97 +1,128 @@
 from pyspark.sql import SQLContext
 import h5py
-from pyspark import SparkConf, SparkContext
+from pyspark import SparkConf, SparkContext, StorageLevel
 from datetime import datetime, date, timedelta
 import sys
-from pyspark.sql.types import Row, StructField, StructType, StringType, IntegerType, LongType
+from pyspark.sql.types import Row, StructField, StructType, StringType, ByteType, ShortType, IntegerType, LongType
 import os
-from os.path import dirname, basename
-from tempfile import NamedTemporaryFile
-from utils.helper import saveDataset   # If you added a file in sc in above step then import it for usage
+from os.path import dirname
+from utils.helper import saveDataset, registerDataset, dataset_location, imported_layout, rollup_granularity, path_size, ship_modules   # If you added a file in sc in above step then import it for usage
+from utils.partitioning import pack_keys
+from utils.tables import TABLES, SCHEMA_STRINGS, TIME_FIELDS, DAY_MS, CHUNK_SIZE, pa, iter_hdf5_chunks, column_type, sort_columns, profile_of, check_narrowed, arrow_write_options, arrow_filesystem, write_arrow_tables
 import json
 import argparse
-import subprocess
-import socket
+from multiprocessing.pool import ThreadPool
 
 
-def add_all_dates(config, originalpath):
+# Reads the row counts of every date group from the HDF5 metadata, no table data is loaded
+def hdf5_key_sizes(originalpath):
 
-    sparkles_tmp_dir_local = config['SPARKLES_TMP_DIR_LOCAL']
-    sparkles_tmp_dir = config['SPARKLES_TMP_DIR']
-    hfile = NamedTemporaryFile(delete=False, dir=sparkles_tmp_dir_local)
+    sizes = {}
     with h5py.File(originalpath) as curr_file:
-            filekeys = curr_file.keys()
-            for k in filekeys:
-                print>>hfile, k
-    hfile.close()
-    subprocess.check_call(['hdfs', 'dfs', '-copyFromLocal', '-f', hfile.name, sparkles_tmp_dir])  # Copy the temporary file to HDFS
-    os.unlink(hfile.name)
-    return hfile
+        for k in curr_file.keys():
+            sizes[k] = dict((table, curr_file[k][table].shape[0]) for table in TABLES)
 
+    return sizes
 
-def orders_sql(configstr, orders, sqlContext, userdatadir, originalpath, description, details):
 
-    schemaString_orders = "id ref ob_id created destroyed side price quantity is_round past_id new_id p_id"
+# Column types a write profile can choose from as Spark SQL types
+SQL_TYPES = {'byte': ByteType, 'short': ShortType, 'int': IntegerType, 'long': LongType}
 
-    fields_orders = []
-    for field_name in schemaString_orders.split():
-        if(field_name not in ['created', 'destroyed']):
-            fields_orders.append(StructField(field_name, IntegerType(), True))
-        else:
-            fields_orders.append(StructField(field_name, LongType(), True))
 
-    schema_orders = StructType(fields_orders)
+def table_schema(table, profile=None):
+
+    fields = []
+    for field_name in SCHEMA_STRINGS[table].split():
+        fields.append(StructField(field_name, SQL_TYPES[column_type(table, field_name, profile)](), True))
+
+    return StructType(fields)
+
+
+# Adds the derived partition columns to the dataframe (ob_id is already there) and sorts the rows for writing
+def prepare_layout(dataframe, table, options):
+
+    if(not options):
+        return dataframe
+
+    if('day' in options.get('partition_by', [])):
+        dataframe = dataframe.withColumn('day', (dataframe[TIME_FIELDS[table]] / DAY_MS).cast(IntegerType()))
+
+    columns = sort_columns(table, options)
+    if(columns):
+        dataframe = dataframe.sort(*columns)  # Range partitioned, every task writes a contiguous slice of the order
+
+    return dataframe
+
+
+def orders_sql(configstr, orders, sqlContext, userdatadir, originalpath, description, details, options=None):
 
     # Apply the schema to the RDD.
-    schemaOrders = sqlContext.createDataFrame(orders, schema_orders)
+    schemaOrders = sqlContext.createDataFrame(orders, table_schema('ORDERS', profile_of(options)))
+    saveDataset(configstr, prepare_layout(schemaOrders, 'ORDERS', options), userdatadir, "orders", originalpath, description, details, options)
+    return schemaOrders
 
-    # schemaOrders.show()
-    # schemaOrders.registerTempTable("orders")
 
-    # results = sqlContext.sql("SELECT id, price, side FROM orders")
-    # for (id, price, side) in results.collect():
-    #    print(price)
+def cancels_sql(configstr, cancels, sqlContext, userdatadir, originalpath, description, details, options=None):
 
-    saveDataset(configstr, schemaOrders, userdatadir, "orders", originalpath, description, details)
+    schemaCancels = sqlContext.createDataFrame(cancels, table_schema('CANCELS', profile_of(options)))
+    saveDataset(configstr, prepare_layout(schemaCancels, 'CANCELS', options), userdatadir, "cancels", originalpath, description, details, options)
+    return schemaCancels
 
 
-def cancels_sql(configstr, cancels, sqlContext, userdatadir, originalpath, description, details):
+def trades_sql(configstr, trades, sqlContext, userdatadir, originalpath, description, details, options=None):
 
-    schemaString_cancels = "id past_id new_id ob_id timestamp side price quantity"
-    fields_cancels = []
-    for field_name in schemaString_cancels.split():
-        if(field_name not in ['timestamp']):
-            fields_cancels.append(StructField(field_name, IntegerType(), True))
-        else:
-            fields_cancels.append(StructField(field_name, LongType(), True))
+    schemaTrades = sqlContext.createDataFrame(trades, table_schema('TRADES', profile_of(options)))
+    saveDataset(configstr, prepare_layout(schemaTrades, 'TRADES', options), userdatadir, "trades", originalpath, description, details, options)
+    return schemaTrades
 
-    schema_cancels = StructType(fields_cancels)
-    schemaCancels = sqlContext.createDataFrame(cancels, schema_cancels)
-    # schemaCancels.saveAsParquetFile("files/cancels_name.parquet")
-    saveDataset(configstr, schemaCancels, userdatadir, "cancels", originalpath, description, details)
 
+TABLE_SQL = {'ORDERS': orders_sql, 'CANCELS': cancels_sql, 'TRADES': trades_sql}
 
-def trades_sql(configstr, trades, sqlContext, userdatadir, originalpath, description, details):
 
-    schemaString_trades = "id ref o_id ob_id timestamp side quantity price p_id cp_id"
-    fields_trades = []
-    for field_name in schemaString_trades.split():
-        if(field_name not in ['timestamp']):
-            fields_trades.append(StructField(field_name, IntegerType(), True))
-        else:
-            fields_trades.append(StructField(field_name, LongType(), True))
+# The layout and metadata of the event count rollup written next to a table, None when no rollup is written
+# A table which already has rows keeps the granularity of its rollup, or stays without one
+def rollup_options(configstr, table, userdatadir, originalpath, granularity, append, existing_keys, partition_by, all_keys):
+
+    name, tablepath = dataset_location(userdatadir, table + '_ROLLUP', originalpath)[1:]
+    if(append and existing_keys):
+        held_granularity = rollup_granularity(configstr, name)
+        if(held_granularity is None):
+            if(granularity):
+                print(name + ': not created, the existing rows of ' + table + ' have no rollup')
+            return None
+        granularity = held_granularity
+
+    if(not granularity):
+        return None
+
+    return {'append': append, 'granularity': int(granularity), 'tablepath': tablepath, 'partition_by': ['day'] if 'day' in partition_by else [],
+            'hdf5_keys': all_keys, 'module_parameters': {'granularity': int(granularity)}, 'parents': [dataset_location(userdatadir, table, originalpath)[1]]}
+
+
+# Counts the events of the imported rows per ob_id and rollup bucket (the bucket start time in epoch milliseconds)
+# The rows of an append are counted separately, readers sum the counts of a bucket
+def rollup_dataframe(dataframe, table, options):
 
-    schema_trades = StructType(fields_trades)
-    schemaTrades = sqlContext.createDataFrame(trades, schema_trades)
-    # schemaTrades.saveAsParquetFile("files/trades_name.parquet")
-    saveDataset(configstr, schemaTrades, userdatadir, "trades", originalpath, description, details)
+    time = dataframe[TIME_FIELDS[table]]
+    bucket = (time - time % options['granularity']).cast(LongType())
+    rollup = dataframe.select(dataframe.ob_id.cast(IntegerType()).alias('ob_id'), bucket.alias('timestamp')).groupBy('ob_id', 'timestamp').count()
+    if('day' in options['partition_by']):
+        rollup = rollup.withColumn('day', (rollup.timestamp / DAY_MS).cast(IntegerType()))
 
+    return rollup
 
-def import_hdf5(x, originalpath, table):
+
+# Reads the tables of one date group with a single open of the file, every row is tagged with its table name
+# The chunks are checked against the column types of the write profiles (table to profile) of the tables
+def import_hdf5_group(x, originalpath, chunk_size=CHUNK_SIZE, tables=TABLES, profiles=None):
 
     with h5py.File(originalpath) as f:
-        data = f[str(x)].get(table)
-        return list(data[:])
+        group = f[str(x)]
+        for table in tables:
+            for chunk in iter_hdf5_chunks(group.get(table), chunk_size):
+                check_narrowed(chunk, table, (profiles or {}).get(table))
+                for row in chunk:
+                    yield (table, row)
 
 
 def numpy_to_native(x):
@@ -99,6 +130,168 @@ def numpy_to_native(x):
     return x.tolist()
 
 
+def arrow_import(configstr, keys, key_tables, table_options, sqlContext, userdatadir, originalpath, description, details, chunk_size, append):
+
+    if(pa is None):
+        raise RuntimeError("The arrow import mode requires pyarrow on the driver and the workers")
+
+    for table in table_options:  # Fails on the driver for the write profiles which the arrow writer can not follow
+        arrow_write_options(table, table_options[table])
+
+    tablepaths = {}
+    for table in TABLES:
+        tablepaths[table] = dataset_location(userdatadir, table, originalpath)[2]
+        paths = [tablepaths[table]]
+        if(table_options.get(table, {}).get('rollup')):
+            paths.append(table_options[table]['rollup']['tablepath'])
+        for tablepath in paths:
+            filesystem, path = arrow_filesystem(tablepath)
+            if(not append and filesystem.exists(path)):
+                raise RuntimeError("Path " + tablepath + " already exists")
+
+    keys.foreach(lambda x: write_arrow_tables(x, originalpath, tablepaths, table_options, chunk_size, key_tables[x]))  # From the utils.tables shipped by main
+
+    # Spark reads the schema back from the written files, so the metadata looks the same as with createDataFrame
+    for table in table_options:
+        dataframe = sqlContext.read.parquet(tablepaths[table])
+        print(tablepaths[table] + ': ' + str(path_size(keys.context, tablepaths[table])) + ' bytes')  # Storage size of the write profile
+        registerDataset(configstr, dataframe, userdatadir, table.lower(), originalpath, description, details, table_options[table])
+        rollup = table_options[table].get('rollup')
+        if(rollup):
+            registerDataset(configstr, sqlContext.read.parquet(rollup['tablepath']), userdatadir, table.lower() + '_rollup', originalpath, description, details, rollup)
+
+
+def import_file(sc, sqlContext, configstr, originalpath, userdatadir, description, details, partitions, options):
+
+    mode = options['mode']
+    chunk_size = options['chunk_size']
+    append = options.get('append', False)
+
+    # The tables to read from every date group, when appending only the groups which a table does not hold yet
+    key_sizes = hdf5_key_sizes(originalpath)
+    key_tables = dict((k, list(TABLES)) for k in key_sizes)
+    existing = dict((table, []) for table in TABLES)
+    partition_by = dict((table, options['partition_by']) for table in TABLES)
+    profile = dict((table, options['profile']) for table in TABLES)
+    if(append):
+        for table in TABLES:
+            held_keys, layout, held_profile = imported_layout(configstr, dataset_location(userdatadir, table, originalpath)[1])
+            existing[table] = held_keys
+            if(layout is not None):  # New rows have to follow the layout and the column types of the existing files
+                partition_by[table] = layout
+                profile[table] = held_profile
+            for k in existing[table]:
+                if(k in key_tables):
+                    key_tables[k].remove(table)
+        key_tables = dict((k, v) for k, v in key_tables.items() if v)
+
+    if(not key_tables):
+        print(originalpath + ': no new date groups to import')
+        return
+
+    # The layout and metadata of every table which gets new rows: all the keys it holds after the import and its row count
+    table_options = {}
+    for table in TABLES:
+        new_keys = [k for k in key_tables if table in key_tables[k]]
+        if(new_keys):
+            all_keys = sorted(set(existing[table]) | set(new_keys))
+            row_count = sum(key_sizes[k][table] for k in all_keys if k in key_sizes)
+            table_options[table] = {'append': append, 'hdf5_keys': all_keys, 'row_count': row_count, 'partition_by': partition_by[table],
+                                    'cluster_by': options['cluster_by'], 'row_group_size': options['row_group_size'], 'profile': profile[table]}
+            rollup = rollup_options(configstr, table, userdatadir, originalpath, options.get('rollup'), append, existing[table], partition_by[table], all_keys)
+            if(rollup):
+                table_options[table]['rollup'] = rollup
+
+    # Spread the date keys over the tasks by their row counts, busy trading days are many times larger than quiet ones
+    bins = pack_keys([(k, sum(key_sizes[k][t] for t in v)) for k, v in key_tables.items()], partitions)
+    keys = sc.parallelize(bins, max(len(bins), 1)).flatMap(lambda x: x)  # One bin per partition
+
+    if(mode == 'arrow'):
+        arrow_import(configstr, keys, key_tables, table_options, sqlContext, userdatadir, originalpath, description, details, chunk_size, append)
+        return
+
+    # One read of each date group feeds all the three tables, the tagged rows are kept until the tables are written
+    profiles = dict((table, profile_of(table_options[table])) for table in table_options)
+    records = keys.flatMap(lambda x: import_hdf5_group(x, originalpath, chunk_size, key_tables[x], profiles))
+    records = records.map(lambda x: (x[0], numpy_to_native(x[1])))
+    records.persist(StorageLevel.MEMORY_AND_DISK)
+
+    try:
+        for table in TABLES:
+            if(table in table_options):
+                rdd = records.filter(lambda x, table=table: x[0] == table).values()
+                dataframe = TABLE_SQL[table](configstr, rdd, sqlContext, userdatadir, originalpath, description, details, table_options[table])
+                tablepath = dataset_location(userdatadir, table, originalpath)[2]
+                print(tablepath + ': ' + str(path_size(sc, tablepath)) + ' bytes')  # Storage size of the write profile
+
+                rollup = table_options[table].get('rollup')
+                if(rollup):  # Counted from the cached records, the raw table is not read back
+                    saveDataset(configstr, rollup_dataframe(dataframe, table, rollup), userdatadir, table.lower() + '_rollup', originalpath, description, details, rollup)
+    finally:
+        records.unpersist()
+
+
+# A write profile is given by its name in IMPORT_PROFILES of the config or directly as a dict with the keys
+# codec (snappy, gzip, zstd...), dictionary (true/false, or the columns to dictionary encode in the arrow mode),
+# delta (delta encode the epoch millisecond columns) and types (column name to byte, short, int or long)
+def write_profile(config, profile):
+
+    if(not profile):
+        return None
+    if(isinstance(profile, dict)):
+        return profile
+
+    profiles = config.get('IMPORT_PROFILES', {})
+    if(profile not in profiles):
+        raise RuntimeError("Write profile " + profile + " not found in IMPORT_PROFILES")
+
+    return dict(profiles[profile], name=profile)
+
+
+# The Spark writer settings hold for the whole application, so an append in the spark mode writes with the profile
+# stored with the existing tables, as the column types are taken from it too. The tables without rows yet get the
+# same profile, the existing ones have to share one
+def stored_profile(configstr, userdatadir, originalpaths, profile):
+
+    stored = {}
+    for originalpath in originalpaths:
+        for table in TABLES:
+            layout, held_profile = imported_layout(configstr, dataset_location(userdatadir, table, originalpath)[1])[1:]
+            if(layout is not None):
+                stored[json.dumps(held_profile, sort_keys=True)] = held_profile
+
+    if(not stored):
+        return profile
+    if(len(stored) > 1):
+        raise RuntimeError("The datasets to append to were written with different write profiles, append to them in separate imports")
+
+    held_profile = list(stored.values())[0]
+    if(profile and profile != held_profile):
+        print('Appending with the write profile of the existing datasets instead of ' + profile.get('name', 'the given one'))
+    return held_profile
+
+
+# Sets the Parquet writer configuration of the spark mode, the settings hold for all the tables of the application
+# The parquet-mr of Spark 1.x only has the global dictionary switch, the columns to dictionary encode can only be
+# chosen in the arrow mode. Its version 2 writer delta encodes the integer columns which are not dictionary encoded
+# (all of them with dictionary false, otherwise the ones whose dictionary outgrows its page)
+def apply_write_profile(sc, sqlContext, profile):
+
+    if(not profile):
+        return
+
+    dictionary = profile.get('dictionary', True)
+    if(isinstance(dictionary, list)):
+        raise RuntimeError("The spark import mode can only turn dictionary encoding on or off for all columns, a list of columns needs the arrow mode")
+
+    hadoopConf = sc._jsc.hadoopConfiguration()
+    if('codec' in profile):
+        sqlContext.setConf("spark.sql.parquet.compression.codec", profile['codec'])
+    hadoopConf.set("parquet.enable.dictionary", str(bool(dictionary)).lower())
+    if(profile.get('delta')):
+        hadoopConf.set("parquet.writer.version", "PARQUET_2_0")
+
+
 def main():
     conf = SparkConf()
     conf.setAppName("Data Import")
@@ -113,6 +306,7 @@ def main():
     parser.add_argument("userdatadir", type=str)
     parser.add_argument("configstr", type=str)
     parser.add_argument("partitions", type=int)
+    parser.add_argument("options", type=str, nargs='?')
 
     args = parser.parse_args()
 
@@ -132,6 +326,7 @@ def main():
     partitions = args.partitions  # Default number of jobs
     helperpath = dirname(os.path.abspath(__file__))
     sc.addFile(helperpath + "/utils/helper.py")  # To import custom modules
+    ship_modules(sc, helperpath, 'utils', ['tables'])  # The HDF5 readers and Parquet writers run on the executors
 
     originalpaths = json.loads(args.originalpaths)
     description = args.description
@@ -141,28 +336,50 @@ def main():
     configstr = args.configstr
     config = json.loads(configstr)
 
-    for originalpath in originalpaths:
-        hfile = add_all_dates(config, originalpath)
-
-        hfile_name = basename(hfile.name)  # hfile.name always returns the full path of the temp file
-        raw_file = sc.textFile('hdfs://' + socket.gethostname() + ':' + str(config['HADOOP_RPC_PORT']) + config['SPARKLES_TMP_DIR'] + hfile_name, partitions)
-
-        rdd1 = raw_file.flatMap(lambda x: import_hdf5(x, originalpath, "ORDERS"))
-        rdd1 = rdd1.map(numpy_to_native)
-
-        rdd2 = raw_file.flatMap(lambda x: import_hdf5(x, originalpath, "CANCELS"))
-        rdd2 = rdd2.map(numpy_to_native)
-
-        rdd3 = raw_file.flatMap(lambda x: import_hdf5(x, originalpath, "TRADES"))
-        rdd3 = rdd3.map(numpy_to_native)
-
-        # print(rdd1.count())
+    options = {}
+    if(args.options):
+        options = json.loads(args.options)
+    options.setdefault('mode', 'spark')  # 'arrow' writes Parquet straight from the NumPy arrays
+    options.setdefault('partition_by', config.get('IMPORT_PARTITION_BY', ['day']))  # Parquet partition columns, 'day' and/or 'ob_id'
+    options.setdefault('cluster_by', config.get('IMPORT_CLUSTER_BY', 'time'))  # Sort order of the written rows: 'time', 'ob_id' or 'none'
+    options.setdefault('row_group_size', config.get('IMPORT_ROW_GROUP_SIZE'))  # Parquet row group size in bytes
+    options['profile'] = write_profile(config, options.get('profile'))
+    options.setdefault('rollup', config.get('IMPORT_ROLLUP'))  # Granularity in milliseconds of the event count rollups, none by default
+    options['chunk_size'] = int(options.get('chunk_size', config.get('IMPORT_CHUNK_SIZE', CHUNK_SIZE)))  # Bounds the executor memory used per table
+    concurrency = int(options.get('concurrency', config.get('IMPORT_CONCURRENCY', 4)))  # Files imported at the same time
+
+    sqlContext = SQLContext(sc)
+
+    if(options['row_group_size']):
+        sc._jsc.hadoopConfiguration().setInt("parquet.block.size", int(options['row_group_size']))
+    if(options['mode'] == 'spark'):  # The arrow mode writes with the options of arrow_write_options
+        if(options.get('append')):
+            options['profile'] = stored_profile(configstr, userdatadir, originalpaths, options['profile'])
+        apply_write_profile(sc, sqlContext, options['profile'])
+
+    # Every file runs as its own set of Spark jobs, submitted from a bounded pool of driver threads
+    def import_file_safe(originalpath):
+        try:
+            import_file(sc, sqlContext, configstr, originalpath, userdatadir, description, details, partitions, options)
+            return (originalpath, None)
+        except Exception as e:
+            return (originalpath, e)
+
+    pool = ThreadPool(max(min(concurrency, len(originalpaths)), 1))
+    results = pool.map(import_file_safe, originalpaths)
+    pool.close()
+    pool.join()
+
+    failed = []
+    for originalpath, error in results:
+        if(error is None):
+            print(originalpath + ': imported')
+        else:
+            print(originalpath + ': failed: ' + str(error))
+            failed.append(originalpath)
 
-        sqlContext = SQLContext(sc)
-        orders_sql(configstr, rdd1, sqlContext, userdatadir, originalpath, description, details)
-        cancels_sql(configstr, rdd2, sqlContext, userdatadir, originalpath, description, details)
-        trades_sql(configstr, rdd3, sqlContext, userdatadir, originalpath, description, details)
-        # os.unlink(hfile.name)
+    if(failed):
+        raise RuntimeError("Import failed for " + ', '.join(failed))
 
 
 if __name__ == '__main__':
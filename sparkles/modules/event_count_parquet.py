@@ -1,36 +1,102 @@
 # Counts the number of events from start to end time in a given window of fixed interval
+# Several intervals (params interval as a list) and several event tables (inputs) are counted in one scan
 import h5py
 from pyspark import SparkConf, SparkContext
 from pyspark.sql.types import Row, StructField, StructType, StringType, IntegerType, LongType
 from datetime import datetime, date, timedelta
 import sys
-from operator import add
 from pyspark.sql import SQLContext
+from pyspark.sql.functions import floor, lit, sum as sum_col
+from functools import reduce
 import os
 import json
-from sparkles.modules.utils.helper import saveFeatures
+from sparkles.modules.utils.helper import saveFeatures, previewFeatures, find_rollup
+from sparkles.modules.utils.intervals import table_name, rollup_fits, parse_intervals, count_columns
+from sparkles.modules.utils.tables import DAY_MS, TIME_FIELDS
 from os.path import dirname
 import argparse
 import time
 import calendar
 
 
-# Hash the keys into different interval periods
-def keymod(x, start_time, interval):
+# Selects the table name, the event time and a count of one for the events in the window from one input dataset
+def event_times(sqlContext, filepath, table, index, start_time, end_time):
 
-    curr_t = x.created
-    curr_t = curr_t - start_time
-    keyindex = int(curr_t / interval)
-    return (keyindex, 1)
+    df = sqlContext.read.parquet(filepath)
+    column = TIME_FIELDS.get(table, 'created' if 'created' in df.columns else 'timestamp')
+
+    tempname = 'EVENTS' + str(index)
+    df.registerTempTable(tempname)
+    query = "SELECT '" + table + "' AS tablename, `" + column + "` AS created, 1 AS events FROM " + tempname + " WHERE `" + column + "` <" + str(end_time) + " AND `" + column + "` >=" + str(start_time)
+    if('day' in df.columns):  # Day partitioned dataset, only the partitions overlapping the window are listed and read
+        query += " AND day >=" + str(start_time // DAY_MS) + " AND day <=" + str((end_time - 1) // DAY_MS)
+    return sqlContext.sql(query)
+
+
+# The same selection from the count rollup of the input, every row stands for the events of one ob_id in one bucket
+def rollup_times(sqlContext, filepath, table, index, start_time, end_time):
+
+    df = sqlContext.read.parquet(filepath)
+
+    tempname = 'ROLLUP' + str(index)
+    df.registerTempTable(tempname)
+    query = "SELECT '" + table + "' AS tablename, `timestamp` AS created, `count` AS events FROM " + tempname + " WHERE `timestamp` <" + str(end_time) + " AND `timestamp` >=" + str(start_time)
+    if('day' in df.columns):
+        query += " AND day >=" + str(start_time // DAY_MS) + " AND day <=" + str((end_time - 1) // DAY_MS)
+    return sqlContext.sql(query)
+
+
+def module_implementation(sc, sqlContext, params=None, inputs=None, features=None):
+
+    if(features is None):
+        features = {}
 
+    start_time_str = str(params['start_time'])
+    start_time = int(str(calendar.timegm(time.strptime(start_time_str[:-4], '%Y-%m-%d_%H:%M:%S'))) + start_time_str[-3:])  # convert to epoch
+
+    end_time_str = str(params['end_time'])
+    end_time = int(str(calendar.timegm(time.strptime(end_time_str[:-4], '%Y-%m-%d_%H:%M:%S'))) + end_time_str[-3:])  # convert to epoch
+
+    intervals = parse_intervals(params['interval'])
+    finest = intervals[0]
+
+    sqlContext.setConf("spark.sql.parquet.filterPushdown", "true")  # Skip the row groups whose statistics fall outside the window
+
+    sources = []
+    for i, filepath in enumerate(inputs):
+        filepath = str(filepath)
+        rollup = None
+        if('configstr' in features):  # The count rollups written by the import are found through the metadata
+            rollup = find_rollup(str(features['configstr']), filepath)
+        if(rollup_fits(rollup, intervals, start_time, end_time)):
+            print(filepath + ': counted from the rollup ' + rollup[0])
+            sources.append(rollup_times(sqlContext, rollup[0], table_name(filepath), i, start_time, end_time))
+        else:
+            sources.append(event_times(sqlContext, filepath, table_name(filepath), i, start_time, end_time))
+    df = reduce(lambda a, b: a.unionAll(b), sources)
 
-# Transform the final time
-def timetr(x, start_time, interval):
+    # The events are bucketed with column expressions so that the whole count runs in the JVM
+    buckets = df.select(df.tablename, floor((df.created - start_time) / finest).cast(LongType()).alias('bucket'), df.events)
+    finest_counts = buckets.groupBy('tablename', 'bucket').agg(sum_col('events').alias('count'))
+    finest_counts.cache()  # The coarser counts are summed from the finest ones instead of scanning the inputs again
 
-    dt = int(start_time + x[0] * interval)
-    # t = (start_time + x[0] * interval) / 1000.0
-    # dt = datetime.fromtimestamp(t).strftime('%Y-%m-%d %H:%M:%S.%f')  # x[0] is keyindex
-    return (dt, x[1])  # x[1] is the total aggregated count
+    rollups = []
+    for interval in intervals:
+        counts = finest_counts
+        if(interval != finest):
+            ratio = int(round(interval / finest))
+            counts = counts.select(counts.tablename, floor(counts.bucket / ratio).cast(LongType()).alias('bucket'), counts['count'])
+            counts = counts.groupBy('tablename', 'bucket').agg(sum_col('count').alias('count'))
+        rollups.append(counts.select(counts.tablename.alias('table'), lit(interval).cast(LongType()).alias('interval'), (start_time + counts.bucket * interval).cast(LongType()).alias('timestamp'), counts['count'].cast(IntegerType()).alias('count')))
+
+    dfRdd = reduce(lambda a, b: a.unionAll(b), rollups)
+    dfRdd = dfRdd.sort('table', 'interval', 'timestamp')
+    dfRdd = dfRdd.select(*count_columns(intervals, inputs))
+    dfRdd = saveFeatures(dfRdd, features, params, inputs)  # Save as a parquet file and create metadata entry, the result is read back from it
+    previewFeatures(dfRdd, features)
+    finest_counts.unpersist()
+
+    return dfRdd
 
 
 def main():
@@ -68,45 +134,12 @@ def main():
 
     params = json.loads(args.params)
     inputs = json.loads(args.inputs)
-    features = json.loads(args.features)
-
-    start_time_str = str(params['start_time'])
-    start_time = int(str(calendar.timegm(time.strptime(start_time_str[:-4], '%Y-%m-%d_%H:%M:%S'))) + start_time_str[-3:])  # convert to epoch
-
-    end_time_str = str(params['end_time'])
-    end_time = int(str(calendar.timegm(time.strptime(end_time_str[:-4], '%Y-%m-%d_%H:%M:%S'))) + end_time_str[-3:])  # convert to epoch
-
-    interval = float(params['interval'])
-
-    filepath = str(inputs[0])  # Provide the complete path
+    features = json.loads(args.features) if args.features else {}
 
     sqlContext = SQLContext(sc)
     sqlContext.setConf("spark.sql.shuffle.partitions", shuffle_partitions)
 
-    df = sqlContext.read.parquet(filepath)
-
-    df.registerTempTable('ORDERS')
-    df = sqlContext.sql("SELECT created FROM ORDERS WHERE created <" + str(end_time) + " AND created >=" + str(start_time))
-
-    rdd = df.map(lambda x: keymod(x, start_time, interval)).reduceByKey(add)
-    rdd = rdd.sortByKey()
-    rdd = rdd.map(lambda x: timetr(x, start_time, interval))  # Human readable time
-
-    # Generate the Schema for the feature dataframe
-    schemaString = "timestamp count"
-
-    fields_df = []
-    for field_name in schemaString.split():
-        if(field_name == 'count'):
-            fields_df.append(StructField(field_name, IntegerType(), True))
-        else:
-            fields_df.append(StructField(field_name, LongType(), True))
-
-    schema_rdd = StructType(fields_df)
-    dfRdd = sqlContext.createDataFrame(rdd, schema_rdd)
-    saveFeatures(dfRdd, features, params, inputs)  # Save as a parquet file and create metadata entry
-
-    print(rdd.collect())
+    module_implementation(sc, sqlContext, params=params, inputs=inputs, features=features)
 
     sc.stop()
 
@@ -1,4 +1,4 @@
-# Counts the number of events from start to end time in a given window of fixed interval
+# Liquidity curves: the quantity on the buy and sell side of the book at every price level, sampled at a fixed interval
 import h5py
 from pyspark import SparkConf, SparkContext
 from pyspark.sql.types import Row, StructField, StructType, StringType, IntegerType, LongType, ArrayType, TimestampType
@@ -6,64 +6,53 @@ from datetime import datetime, date, timedelta
 import sys
 from operator import add
 from pyspark.sql import SQLContext
+from pyspark.sql.functions import sum as sum_col
 import os
 import json
-from sparkles.modules.utils.helper import saveFeatures
+from sparkles.modules.utils.helper import saveFeatures, previewFeatures, ship_modules, ANALYSIS_MODULES
+from sparkles.modules.utils.tables import DAY_MS
+from sparkles.modules.utils.depth import sample_index, select_orders_sql, order_deltas_sql, sweep_depth, insert_sorted, merge_sorted, insert_side, merge_sides, parallel_curves
 import argparse
 import time
-from math import ceil
-from itertools import takewhile
 import calendar
 
+CURVE_FORMATS = ['nested', 'parallel', 'long']
 
-# Transform all the destroy values which are zero to the end of the day's timestamp
-def transform_zero_destroys(x):
 
-    tc = x.created
-    td = x.destroyed
+# The depth changes of the orders ((level, sample), change) summed per level and sample, see order_deltas_sql
+def order_deltas(sqlContext, orders, level_columns, start_time, interval, samples, checkpoint_time=None):
 
-    if(td == 0):
-        tc_dt = datetime.fromtimestamp(tc / 1000)
-        td_dt = datetime(tc_dt.year, tc_dt.month, tc_dt.day, 23, 59, 59)
-        td = calendar.timegm(datetime.timetuple(td_dt)) * 1000
-        td = td + 999  # Add the milliseconds
+    orders.registerTempTable('BOOK_ORDERS')
+    deltas = sqlContext.sql(order_deltas_sql('BOOK_ORDERS', level_columns, start_time, interval, samples, checkpoint_time))
+    deltas = deltas.groupBy(*(level_columns + ['sample'])).agg(sum_col('change').alias('change'))
+    return deltas.map(lambda x: ((tuple(x[:-2]), x[-2]), x[-1]))  # ((level, sample), change)
 
-    return (tc, td, x.side, x.price, x.quantity)
 
+# The (timestamp, (level, depth)) of every sample and non empty level from the depth changes ((level, sample), change)
+# Only the changes are shuffled, instead of one record per order and sample while the order is alive
+def level_depths(deltas, start_time, interval, samples):
 
-# This logic uses reverse generation. It generates input timestamps for each of the records fetched from dataset
-# It shows usage of generators as transformation function for Spark which is quite useful for advance querying
-def generate_timestamps(start_time, end_time, interval):
-    def _generate_timestamps(created, destroyed, side, price, qty):  # Alternative for accessing data using logical indexing
-        start_time_row = int(ceil((created - start_time) / interval) * interval + start_time)
-        filtered_timestamps = takewhile(lambda x: created <= x < destroyed, xrange(start_time_row, end_time, interval))  # Generation
-        for ts in filtered_timestamps:
-            yield (ts, price), qty  # Send the key as timestamp,price and value as qty (in order to sum qty later easily)
+    levels = deltas.map(lambda x: (x[0][0], (x[0][1], x[1]))).aggregateByKey([], insert_sorted, merge_sorted)  # The changes of every level
+    return levels.flatMap(lambda x: sweep_depth(start_time, interval, samples)(*x))
 
-    return _generate_timestamps
 
+# The depth curves of both sides of the book: the buy and sell [price, depth] pairs of every sample timestamp
+# The curves of a timestamp are built by one aggregation with the side as a value dimension, so the timestamps
+# which have orders on one side only are kept with an empty curve on the other side
+def depth_curves(points):
 
-# Sum the quantities for given price at a given time
-def sum_qty_for_price(x):
+    curves = points.aggregateByKey([[], []], insert_side, merge_sides)  # Buy and sell pairs of every timestamp sorted by price
+    return curves.map(lambda x: (x[0], x[1][0], x[1][1]))
 
-    return (x[0][0], [x[0][1], sum(x[1])])  # Back to logical indexing! x[0][1] contains the price and x[1] the quantities
 
+# Helper function to convert rdd to dataframe which is a more efficient for SQL operations like sort
+def rdd_to_dataframe(sqlContext, rdd, curves):
 
-# Sort the pairs
-def sorter(x):
-
-    x.sort()
-    return x
-
-
-# Helper function to convert rdd to dataframe which is a more efficient for SQL operations like join
-def rdd_to_dataframe(sqlContext, rdd, curve):
-
-    schemaString = "timestamp " + curve
+    schemaString = "timestamp " + ' '.join(curves)
 
     fields_rdd = []
     for field_name in schemaString.split():
-        if(field_name == curve):
+        if(field_name in curves):
             fields_rdd.append(StructField(field_name, ArrayType(ArrayType(IntegerType(), True), True), True))
         else:
             fields_rdd.append(StructField(field_name, LongType(), True))
@@ -73,6 +62,161 @@ def rdd_to_dataframe(sqlContext, rdd, curve):
     return df
 
 
+def parallel_dataframe(sqlContext, rdd):
+
+    schemaString = "timestamp buy_price buy_depth sell_price sell_depth"
+
+    fields_rdd = []
+    for field_name in schemaString.split():
+        if(field_name == 'timestamp'):
+            fields_rdd.append(StructField(field_name, LongType(), True))
+        else:
+            fields_rdd.append(StructField(field_name, ArrayType(IntegerType(), True), True))
+
+    return sqlContext.createDataFrame(rdd, StructType(fields_rdd))
+
+
+# The long format has one row per timestamp and non empty level, the day of the timestamp is the partition column
+def long_dataframe(sqlContext, rdd):
+
+    schemaString = "timestamp side price depth day"
+
+    fields_rdd = []
+    for field_name in schemaString.split():
+        if(field_name in ['timestamp', 'depth']):
+            fields_rdd.append(StructField(field_name, LongType(), True))
+        else:
+            fields_rdd.append(StructField(field_name, IntegerType(), True))
+
+    return sqlContext.createDataFrame(rdd, StructType(fields_rdd))
+
+
+# The checkpoint featureset has one row per checkpoint timestamp and non empty book level
+def checkpoint_dataframe(sqlContext, rdd):
+
+    schemaString = "timestamp ob_id side price depth"
+
+    fields_rdd = []
+    for field_name in schemaString.split():
+        if(field_name in ['timestamp', 'depth']):
+            fields_rdd.append(StructField(field_name, LongType(), True))
+        else:
+            fields_rdd.append(StructField(field_name, IntegerType(), True))
+
+    return sqlContext.createDataFrame(rdd, StructType(fields_rdd))
+
+
+# The orders which are on the book at some point from the since time to the end time. Orders which stay on the book
+# until the end of the day have destroyed 0, which is replaced with the last millisecond of the day of created
+def select_orders(sqlContext, filepath, since, end_time, ob_id=None):
+
+    df = sqlContext.read.parquet(filepath)
+
+    df.registerTempTable('ORDERS')
+    return sqlContext.sql(select_orders_sql('ORDERS', since, end_time, ob_id, 'day' in df.columns))
+
+
+# The time of the latest checkpoint at or before start_time and its book state as depth changes at the first sample
+# Returns (None, None) when the checkpoints start later
+def load_checkpoint(sqlContext, filepath, start_time, ob_id=None):
+
+    df = sqlContext.read.parquet(filepath)
+
+    df.registerTempTable('CHECKPOINTS')
+    condition = ""
+    if(ob_id is not None):
+        condition = " AND ob_id =" + str(int(ob_id))
+
+    latest = sqlContext.sql("SELECT MAX(`timestamp`) AS latest FROM CHECKPOINTS WHERE `timestamp` <=" + str(start_time) + condition).first().latest
+    if(latest is None):
+        return (None, None)
+
+    state = sqlContext.sql("SELECT side, price, depth FROM CHECKPOINTS WHERE `timestamp` =" + str(latest) + condition)
+    return (latest, state.map(lambda x: (((x.side, x.price), 0), x.depth)))  # The books of all the ob_ids add up
+
+
+def module_implementation(sc, sqlContext, params=None, inputs=None, features=None):
+
+    ''' params: start_time, end_time, interval and optionally ob_id (one order book only) and mode
+    mode 'query' (default) computes the liquidity curves at every interval. With the featureset of a checkpoint run as the
+    second input, the replay starts from the latest checkpoint at or before start_time instead of the whole trading day
+    mode 'checkpoint' stores the depth of every ob_id, side and price level at every interval (e.g. 60000 for every minute)
+    curve_format of the query mode:
+    'nested' (default) one row per timestamp with curve_buy and curve_sell as lists of [price, depth]
+    'parallel' one row per timestamp with buy_price, buy_depth, sell_price and sell_depth arrays, with delta_prices
+    the prices after the first are steps from the previous price (decode_prices restores them)
+    'long' one row per timestamp, side and price level with its depth, partitioned by day
+    '''
+
+    if(features is None):
+        features = {}
+
+    start_time_str = str(params['start_time'])
+    start_time = int(str(calendar.timegm(time.strptime(start_time_str[:-4], '%Y-%m-%d_%H:%M:%S'))) + start_time_str[-3:])  # convert to epoch
+
+    end_time_str = str(params['end_time'])
+    end_time = int(str(calendar.timegm(time.strptime(end_time_str[:-4], '%Y-%m-%d_%H:%M:%S'))) + end_time_str[-3:])  # convert to epoch
+
+    interval = int(params['interval'])
+    mode = params.get('mode', 'query')
+    ob_id = params.get('ob_id')
+    curve_format = params.get('curve_format', 'nested')
+    delta_prices = bool(params.get('delta_prices', False))
+    if(curve_format not in CURVE_FORMATS):
+        raise RuntimeError("Unknown curve format " + str(curve_format) + ", the curve format is one of " + ', '.join(CURVE_FORMATS))
+    partition_by = None
+
+    filepath = str(inputs[0])  # Provide the complete path
+
+    sqlContext.setConf("spark.sql.parquet.filterPushdown", "true")  # Skip the row groups whose statistics fall outside the window
+
+    samples = sample_index(end_time, start_time, interval)  # The sample timestamps are the ones before end_time
+
+    if(mode == 'checkpoint'):
+        orders = select_orders(sqlContext, filepath, start_time, end_time, ob_id)
+        points = level_depths(order_deltas(sqlContext, orders, ['ob_id', 'side', 'price'], start_time, interval, samples), start_time, interval, samples)
+
+        rdd = points.map(lambda x: (x[0], x[1][0][0], x[1][0][1], x[1][0][2], x[1][1]))
+        df_total = checkpoint_dataframe(sqlContext, rdd)
+        df_total = df_total.sort('timestamp', 'ob_id', 'side', 'price')
+
+    elif(mode == 'query'):
+        checkpoint_time = None
+        if(len(inputs) > 1):  # A checkpoint featureset
+            checkpoint_time, state = load_checkpoint(sqlContext, str(inputs[1]), start_time, ob_id)
+
+        if(checkpoint_time is None):
+            orders = select_orders(sqlContext, filepath, start_time, end_time, ob_id)
+            deltas = order_deltas(sqlContext, orders, ['side', 'price'], start_time, interval, samples)
+        else:
+            print('Replaying the orders from the checkpoint at ' + str(checkpoint_time))
+            orders = select_orders(sqlContext, filepath, checkpoint_time, end_time, ob_id)
+            deltas = order_deltas(sqlContext, orders, ['side', 'price'], start_time, interval, samples, checkpoint_time).union(state)
+
+        points = level_depths(deltas, start_time, interval, samples)
+        if(curve_format == 'long'):  # The depths are written as they come out of the sweep, without grouping by timestamp
+            rdd = points.map(lambda x: (x[0], x[1][0][0], x[1][0][1], x[1][1], x[0] // DAY_MS))
+            df_total = long_dataframe(sqlContext, rdd)
+            df_total = df_total.sort('day', 'timestamp', 'side', 'price')
+            partition_by = ['day']
+        elif(curve_format == 'parallel'):
+            rdd = depth_curves(points).map(lambda x: (x[0],) + parallel_curves(x[1], delta_prices) + parallel_curves(x[2], delta_prices))
+            df_total = parallel_dataframe(sqlContext, rdd)
+            df_total = df_total.sort(df_total.timestamp)
+        else:
+            rdd = depth_curves(points)
+            df_total = rdd_to_dataframe(sqlContext, rdd, ["curve_buy", "curve_sell"])
+            df_total = df_total.sort(df_total.timestamp)
+
+    else:
+        raise RuntimeError("Unknown mode " + str(mode) + ", the mode is query or checkpoint")
+
+    df_total = saveFeatures(df_total, features, params, inputs, partition_by)  # Save the featureset, the result is read back from it
+    previewFeatures(df_total, features)  # Print out the first results
+
+    return df_total
+
+
 def main():
     conf = SparkConf()
     conf.setAppName("Liq Cost Parquet")
@@ -104,58 +248,17 @@ def main():
 
     helperpath = args.helperpath
     sc.addFile(helperpath + "/utils/helper.py")  # To import custom modules
+    ship_modules(sc, helperpath, 'sparkles.modules.utils', ANALYSIS_MODULES)  # The depth curves are built on the executors
     shuffle_partitions = args.shuffle_partitions
 
     params = json.loads(args.params)
     inputs = json.loads(args.inputs)
-    features = json.loads(args.features)
-
-    start_time_str = str(params['start_time'])
-    start_time = int(str(calendar.timegm(time.strptime(start_time_str[:-4], '%Y-%m-%d_%H:%M:%S'))) + start_time_str[-3:])  # convert to epoch
-
-    end_time_str = str(params['end_time'])
-    end_time = int(str(calendar.timegm(time.strptime(end_time_str[:-4], '%Y-%m-%d_%H:%M:%S'))) + end_time_str[-3:])  # convert to epoch
-
-    interval = int(params['interval'])
-
-    filepath = str(inputs[0])  # Provide the complete path
+    features = json.loads(args.features) if args.features else {}
 
     sqlContext = SQLContext(sc)
     sqlContext.setConf("spark.sql.shuffle.partitions", shuffle_partitions)
 
-    df = sqlContext.read.parquet(filepath)
-
-    df.registerTempTable('ORDERS')
-    df = sqlContext.sql("SELECT created, destroyed, side, price, quantity FROM ORDERS WHERE created <=" + str(end_time) + " AND destroyed >" + str(start_time))
-
-    rdd = df.map(lambda x: transform_zero_destroys(x))
-
-    rdd1 = rdd.filter(lambda x: x[2] == 66)  # Filter records for Buy, logical index 2 represents Side here
-    rdd2 = rdd.filter(lambda x: x[2] == 83)  # Filter records for Sell
-
-    rdd1 = rdd1.flatMap(lambda x: generate_timestamps(start_time, end_time, interval)(*x)).groupByKey()
-    rdd2 = rdd2.flatMap(lambda x: generate_timestamps(start_time, end_time, interval)(*x)).groupByKey()
-
-    rdd1 = rdd1.map(lambda x: sum_qty_for_price(x)).groupByKey()
-    rdd2 = rdd2.map(lambda x: sum_qty_for_price(x)).groupByKey()
-
-    rdd1 = rdd1.mapValues(list)
-    rdd1 = rdd1.mapValues(lambda x: sorter(x))
-
-    rdd2 = rdd2.mapValues(list)
-    rdd2 = rdd2.mapValues(lambda x: sorter(x))
-
-    df_buy = rdd_to_dataframe(sqlContext, rdd1, "curve_buy")
-    df_sell = rdd_to_dataframe(sqlContext, rdd2, "curve_sell")
-
-    df_total = df_buy.join(df_sell, df_buy.timestamp == df_sell.timestamp)
-    df_total = df_total.select(df_buy.timestamp, df_total.curve_buy, df_total.curve_sell)  # Just one timestamp field should be there not two!
-    df_total = df_total.sort(df_total.timestamp)
-
-    saveFeatures(df_total, features, params, inputs)  # Save the featureset
-
-    for k in df_total.collect():  # Print out the results
-        print(k)
+    module_implementation(sc, sqlContext, params=params, inputs=inputs, features=features)
 
     sc.stop()
 
@@ -7,7 +7,7 @@ from operator import add
 from pyspark.sql import SQLContext
 import os
 import json
-from sparkles.modules.utils.helper import saveFeatures  # If you need to save result as a feature set
+from sparkles.modules.utils.helper import saveFeatures, previewFeatures  # If you need to save result as a feature set
 from os.path import dirname
 import argparse
 import time
@@ -41,8 +41,9 @@ def module_implementation(sc, sqlContext, params=None, inputs=None, features=Non
     feature_dataframe = sqlContext.createDataFrame(rdd, schema_df)  # Dataframe for featureset created here
 
     # Don't change the lines below
-    saveFeatures(feature_dataframe, features, params, inputs)  # Just pass the feature_dataframe which you generated for your results to this function. (features, params, inputs remain as it is)
-    sc.stop()
+    feature_dataframe = saveFeatures(feature_dataframe, features, params, inputs)  # Just pass the feature_dataframe which you generated for your results to this function. (features, params, inputs remain as it is)
+    previewFeatures(feature_dataframe, features)  # Prints the first rows from the saved featureset instead of computing the results again with collect()
+    return feature_dataframe
 
 
 # This is the main function which you do not have to modify!
@@ -84,13 +85,15 @@ def main():
     # Create a dict and pass it in your_module_implementation
     params = json.loads(args.params)
     inputs = json.loads(args.inputs)
-    features = json.loads(args.features)  # Only used when you want to create a feature set
+    features = json.loads(args.features) if args.features else {}  # Only used when you want to create a feature set
 
     sqlContext = SQLContext(sc)  # Create SQLContext var from SparkContext, To work with our default format of datasets i.e. Parquet
     sqlContext.setConf("spark.sql.shuffle.partitions", shuffle_partitions)  # Don't change, required for controlling parallelism
 
     # Pass the sc (Spark Context) and sqlContext along with the different paramters and inputs.
     module_implementation(sc, sqlContext, params=params, inputs=inputs, features=features)
+    sc.stop()
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,96 @@
+import unittest
+import os
+import shutil
+import hashlib
+import tempfile
+from mock import Mock, patch
+from sparkles.modules.utils.checksum import file_checksum, cache_key
+from sparkles.modules.utils.runner import SparkRunner
+
+
+class Checksum_Tests(unittest.TestCase):
+
+    def test_file_checksum(self):
+
+        """The checksum covers the whole content also when it is read in several blocks.
+        """
+        handle, filepath = tempfile.mkstemp()
+        content = b'def module_implementation():\n    pass\n' * 100
+        with os.fdopen(handle, 'wb') as module_file:
+            module_file.write(content)
+
+        self.assertEqual(hashlib.sha256(content).hexdigest(), file_checksum(filepath, block_size=64))
+        os.remove(filepath)
+
+    def test_cache_key(self):
+
+        """The key does not depend on the order of the params, but on their values, the module and the inputs.
+        """
+        key = cache_key('abc', {'start_time': '2012-10-02_09:00:00.000', 'interval': 60000}, [['id1', 100]])
+
+        self.assertEqual(key, cache_key('abc', {'interval': 60000, 'start_time': '2012-10-02_09:00:00.000'}, [['id1', 100]]))
+        self.assertNotEqual(key, cache_key('abd', {'interval': 60000, 'start_time': '2012-10-02_09:00:00.000'}, [['id1', 100]]))
+        self.assertNotEqual(key, cache_key('abc', {'interval': 1000, 'start_time': '2012-10-02_09:00:00.000'}, [['id1', 100]]))
+        self.assertNotEqual(key, cache_key('abc', {'interval': 60000, 'start_time': '2012-10-02_09:00:00.000'}, [['id1', 200]]))
+
+
+class Module_Cache_Tests(unittest.TestCase):
+
+    def setUp(self):
+
+        self.moduledir = tempfile.mkdtemp()
+        self.content = b'def module_implementation():\n    pass\n'
+        self.analysis = Mock(filepath='count.py', checksum=hashlib.sha256(self.content).hexdigest())
+
+        self.runner = SparkRunner.__new__(SparkRunner)
+        self.runner.config = {'BACKEND': 'hdfs', 'MODULES_DIR_LOCAL': self.moduledir + '/'}
+        self.runner.backend = 'hdfs'
+        self.runner.hdfsmodpath = '/modules/'
+        self.runner.session = Mock(**{'query.return_value.from_statement.return_value.params.return_value.first.return_value': self.analysis})
+
+    def tearDown(self):
+
+        shutil.rmtree(self.moduledir)
+
+    def download(self, objs, backend, config):
+
+        for source, destination in objs:
+            with open(destination, 'wb') as module_file:
+                module_file.write(self.content)
+
+    @patch('sparkles.modules.utils.runner.getObjsBackend')
+    def test_module_downloaded_once(self, getObjsBackend):
+
+        """The module is downloaded when there is no local copy and the copy is used while its checksum matches.
+        """
+        getObjsBackend.side_effect = self.download
+
+        out_file = self.runner.fetch_analysis('count')
+        self.assertEqual(os.path.join(self.moduledir, 'count.py'), out_file)
+        self.assertEqual(['count.py'], os.listdir(self.moduledir))  # The temporary file was renamed
+        self.assertEqual(1, getObjsBackend.call_count)
+
+        self.runner.fetch_analysis('count')
+        self.assertEqual(1, getObjsBackend.call_count)
+
+        self.content = b'def module_implementation():\n    return 1\n'  # A new version of the module was imported
+        self.analysis.checksum = hashlib.sha256(self.content).hexdigest()
+        self.runner.fetch_analysis('count')
+        self.assertEqual(2, getObjsBackend.call_count)
+
+    @patch('sparkles.modules.utils.runner.getObjsBackend')
+    def test_failed_download(self, getObjsBackend):
+
+        """A download which is missing or does not match the checksum fails and does not replace the local copy.
+        """
+        with open(os.path.join(self.moduledir, 'count.py'), 'wb') as module_file:
+            module_file.write(b'stale')
+
+        self.assertRaises(RuntimeError, self.runner.fetch_analysis, 'count')  # Nothing downloaded
+
+        self.content = b'partial'
+        getObjsBackend.side_effect = self.download
+        self.assertRaises(RuntimeError, self.runner.fetch_analysis, 'count')
+        self.assertEqual(['count.py'], os.listdir(self.moduledir))  # The download was removed
+        with open(os.path.join(self.moduledir, 'count.py'), 'rb') as module_file:
+            self.assertEqual(b'stale', module_file.read())
@@ -0,0 +1,151 @@
+import unittest
+import math
+import sqlite3
+from collections import defaultdict
+from datetime import datetime
+from sparkles.modules.utils.tables import DAY_MS
+from sparkles.modules.utils.depth import sample_index, select_orders_sql, order_deltas_sql, sweep_depth, insert_sorted, merge_sorted, insert_side, merge_sides, parallel_curves, decode_prices
+
+T0 = 1349168400000  # 2012-10-02 09:00 UTC
+ORDER_COLUMNS = ['ob_id', 'created', 'destroyed', 'side', 'price', 'quantity']
+
+# A small book sampled every 10 ms from T0 + 110: A and B are on the book at the checkpoint at T0 + 105, C comes after it
+ORDERS = [
+    (1, T0 + 95, T0 + 125, 66, 10, 5),
+    (1, T0 + 101, T0 + 115, 83, 12, 3),
+    (1, T0 + 112, T0 + 200, 66, 10, 2)
+]
+EXPECTED = {
+    T0 + 110: {(66, 10): 5, (83, 12): 3},
+    T0 + 120: {(66, 10): 7},
+    T0 + 130: {(66, 10): 2},
+    T0 + 140: {(66, 10): 2}
+}
+
+
+# sqlite stands in for Spark SQL, with the Spark functions used by the queries in UTC
+def sql_database(orders):
+
+    db = sqlite3.connect(':memory:')
+    db.create_function('GREATEST', 2, max)
+    db.create_function('LEAST', 2, min)
+    db.create_function('CEIL', 1, lambda x: int(math.ceil(x)))
+    db.create_function('from_unixtime', 1, lambda seconds: datetime.utcfromtimestamp(seconds).strftime('%Y-%m-%d %H:%M:%S'))
+    db.create_function('to_date', 1, lambda text: text[:10])
+    db.create_function('datediff', 2, lambda end, start: (datetime.strptime(end, '%Y-%m-%d') - datetime.strptime(start, '%Y-%m-%d')).days)
+    db.execute('CREATE TABLE ORDERS (' + ', '.join(ORDER_COLUMNS) + ')')
+    db.executemany('INSERT INTO ORDERS VALUES (?, ?, ?, ?, ?, ?)', orders)
+    return db
+
+
+# The depth of every level and sample from the rows of order_deltas_sql and the depth changes of a checkpoint state,
+# summed, grouped and swept in the same way as the liquidity curve module does with Spark
+def book_depths(db, query, start_time, interval, samples, state=None):
+
+    changes = defaultdict(int)
+    for row in db.execute(query).fetchall():
+        changes[(tuple(row[:-2]), row[-2])] += row[-1]
+    for key, change in (state or {}).items():
+        changes[key] += change
+
+    levels = defaultdict(list)
+    for (level, sample), change in changes.items():
+        insert_sorted(levels[level], (sample, change))
+
+    depths = defaultdict(dict)
+    for level, deltas in levels.items():
+        for ts, (level, depth) in sweep_depth(start_time, interval, samples)(level, deltas):
+            depths[ts][level] = depth
+    return dict(depths)
+
+
+class Depth_Tests(unittest.TestCase):
+
+    def test_sample_index(self):
+
+        """The index of the first sample at or after a time, also before the start of the window.
+        """
+        self.assertEqual(0, sample_index(100, 100, 10))
+        self.assertEqual(1, sample_index(101, 100, 10))
+        self.assertEqual(1, sample_index(110, 100, 10))
+        self.assertEqual(0, sample_index(95, 100, 10))
+        self.assertEqual(-1, sample_index(90, 100, 10))
+
+    def test_sweep_depth(self):
+
+        """The depth of a level at the samples where it is not empty, until the end of the window for the orders left.
+        """
+        sweep = sweep_depth(100, 10, 5)
+        self.assertEqual([(100, ('a', 5)), (110, ('a', 5))], list(sweep('a', [(0, 5), (2, -5)])))
+        self.assertEqual([(110, ('a', 2)), (120, ('a', 5)), (130, ('a', 5)), (140, ('a', 5))], list(sweep('a', [(1, 2), (2, 3)])))
+        self.assertEqual([(100, ('a', 4)), (120, ('a', 1))], list(sweep('a', [(0, 4), (1, -4), (2, 1), (3, -1)])))
+        self.assertEqual([(100, ('a', 3))], list(sweep('a', [(0, 2), (0, 1), (1, -3)])))  # A checkpoint and an order at one sample
+
+    def test_combiners(self):
+
+        """The combiners keep the values sorted within and across partitions.
+        """
+        self.assertEqual([(0, 5), (2, -5), (3, 1)], merge_sorted(insert_sorted(insert_sorted([], (2, -5)), (0, 5)), [(3, 1)]))
+
+        curves = insert_side(insert_side(insert_side([[], []], ((66, 11), 4)), ((83, 12), 3)), ((66, 10), 5))
+        self.assertEqual([[[10, 5], [11, 4]], [[12, 3]]], curves)
+        self.assertEqual([[[9, 1], [10, 5], [11, 4]], [[12, 3]]], merge_sides([[[9, 1]], []], curves))
+
+    def test_parallel_curves(self):
+
+        """Parallel arrays of a curve, with the prices delta encoded and decoded back.
+        """
+        self.assertEqual(([9990, 9995, 10001], [5, 3, 7]), parallel_curves([[9990, 5], [9995, 3], [10001, 7]]))
+        prices, depths = parallel_curves([[9990, 5], [9995, 3], [10001, 7]], delta_prices=True)
+        self.assertEqual([9990, 5, 6], prices)
+        self.assertEqual([9990, 9995, 10001], decode_prices(prices))
+        self.assertEqual(([], []), parallel_curves([], delta_prices=True))
+
+    def test_order_deltas(self):
+
+        """The depths swept from the entering and leaving changes of the orders match the hand computed book.
+        """
+        db = sql_database(ORDERS)
+        start_time, interval = T0 + 110, 10
+        samples = sample_index(T0 + 150, start_time, interval)
+        db.execute('CREATE TABLE BOOK_ORDERS AS ' + select_orders_sql('ORDERS', start_time, T0 + 150))
+
+        query = order_deltas_sql('BOOK_ORDERS', ['side', 'price'], start_time, interval, samples)
+        self.assertEqual(EXPECTED, book_depths(db, query, start_time, interval, samples))
+
+    def test_checkpoint_replay(self):
+
+        """From a checkpoint the orders created before it only leave the book and the later ones enter it.
+        """
+        db = sql_database(ORDERS)
+        checkpoint_time, start_time, interval = T0 + 105, T0 + 110, 10
+        samples = sample_index(T0 + 150, start_time, interval)
+        state = {((66, 10), 0): 5, ((83, 12), 0): 3}  # The book at the checkpoint as changes at the first sample
+        db.execute('CREATE TABLE BOOK_ORDERS AS ' + select_orders_sql('ORDERS', checkpoint_time, T0 + 150))
+
+        query = order_deltas_sql('BOOK_ORDERS', ['side', 'price'], start_time, interval, samples, checkpoint_time)
+        self.assertEqual(EXPECTED, book_depths(db, query, start_time, interval, samples, state))
+
+    def test_checkpoint_replay_earlier_day(self):
+
+        """An order of an earlier day which stayed until its close (destroyed 0) is not in the state of a later checkpoint
+        and must not leave the book again in the replay.
+        """
+        db = sql_database(ORDERS + [(1, T0 - DAY_MS, 0, 66, 10, 4)])
+        checkpoint_time, start_time, interval = T0 + 105, T0 + 110, 10
+        samples = sample_index(T0 + 150, start_time, interval)
+        state = {((66, 10), 0): 5, ((83, 12), 0): 3}
+        db.execute('CREATE TABLE BOOK_ORDERS AS ' + select_orders_sql('ORDERS', checkpoint_time, T0 + 150))
+
+        self.assertEqual(3, db.execute('SELECT COUNT(*) FROM BOOK_ORDERS').fetchone()[0])
+        query = order_deltas_sql('BOOK_ORDERS', ['side', 'price'], start_time, interval, samples, checkpoint_time)
+        self.assertEqual(EXPECTED, book_depths(db, query, start_time, interval, samples, state))
+
+    def test_order_alive_until_close(self):
+
+        """An order with destroyed 0 stays on the book until the end of its day.
+        """
+        db = sql_database([(1, T0 + 95, 0, 66, 10, 5)])
+        db.execute('CREATE TABLE BOOK_ORDERS AS ' + select_orders_sql('ORDERS', T0 + 100, T0 + 150))
+
+        self.assertEqual([(T0 - 9 * 3600000 + DAY_MS - 1,)], db.execute('SELECT destroyed FROM BOOK_ORDERS').fetchall())
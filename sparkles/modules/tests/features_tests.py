@@ -0,0 +1,28 @@
+import unittest
+from mock import Mock, call
+from sparkles.modules.utils.helper import saveFeatures, previewFeatures
+
+
+class Features_Tests(unittest.TestCase):
+
+    def test_save_features_skipped(self):
+
+        """Nothing is written when there is no featureset to save, the result is returned for the preview.
+        """
+        dataframe = Mock()
+        self.assertEqual(dataframe, saveFeatures(dataframe, None, {}, ['AB00']))
+        self.assertEqual(dataframe, saveFeatures(dataframe, {}, {}, ['AB00']))
+        self.assertEqual(dataframe, saveFeatures(dataframe, {'module_testing': True, 'featureset_name': 'feat'}, {}, ['AB00']))
+        self.assertFalse(dataframe.write.parquet.called)
+
+    def test_preview_features(self):
+
+        """The preview takes a bounded number of rows instead of collecting the result.
+        """
+        dataframe = Mock()
+        dataframe.take.return_value = []
+        previewFeatures(dataframe)
+        previewFeatures(dataframe, {'preview_rows': 5})
+
+        self.assertEqual([call(20), call(5)], dataframe.take.call_args_list)
+        self.assertFalse(dataframe.collect.called)
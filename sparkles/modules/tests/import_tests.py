@@ -0,0 +1,195 @@
+import unittest
+import imp
+import os
+import sys
+from mock import Mock, MagicMock, patch
+from sparkles.modules.utils.helper import imported_layout, update_dataset
+
+MODULES_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+KEY_SIZES = {'2012-10-01': {'ORDERS': 10, 'CANCELS': 2, 'TRADES': 3}, '2012-10-02': {'ORDERS': 20, 'CANCELS': 4, 'TRADES': 6}}
+PROFILE = {'codec': 'gzip', 'types': {'side': 'byte'}}
+
+
+# Loads data_import as pyspark runs it, with the utils package on the path. pyspark is not needed to build the layouts
+# and options, it is only stubbed while loading (the utils modules stay loaded, python 2 clears the globals of dropped ones)
+def load_data_import():
+
+    stubs = ['pyspark', 'pyspark.sql', 'pyspark.sql.types']
+    sys.modules.update((name, Mock()) for name in stubs)
+    sys.path.insert(0, MODULES_DIR)
+    try:
+        return imp.load_source('data_import_under_test', os.path.join(MODULES_DIR, 'data_import.py'))
+    finally:
+        sys.path.remove(MODULES_DIR)
+        for name in stubs:
+            del sys.modules[name]
+
+
+data_import = load_data_import()
+
+
+class Append_Tests(unittest.TestCase):
+
+    def setUp(self):
+
+        self.options = {'mode': 'arrow', 'chunk_size': 1000, 'append': True, 'partition_by': ['day'], 'cluster_by': 'time', 'row_group_size': None, 'profile': None, 'rollup': None}
+
+    def import_file(self, layouts):
+
+        with patch.object(data_import, 'hdf5_key_sizes', return_value=KEY_SIZES), \
+                patch.object(data_import, 'imported_layout', side_effect=lambda configstr, name: layouts.get(name, ([], None, None))), \
+                patch.object(data_import, 'rollup_options', return_value=None), \
+                patch.object(data_import, 'arrow_import') as arrow_import:
+            data_import.import_file(Mock(), Mock(), '{}', '/files/AB00.h5', '/data/', 'desc', 'details', 2, self.options)
+        return arrow_import
+
+    def test_append_new_keys(self):
+
+        """Only the date groups a table does not hold yet are read, the metadata gets all the keys and their row count.
+        """
+        layouts = {'AB00_ORDERS': (['2012-10-01'], ['ob_id'], PROFILE), 'AB00_TRADES': (['2012-10-01', '2012-10-02'], [], None)}
+        arrow_import = self.import_file(layouts)
+
+        key_tables, table_options = arrow_import.call_args[0][2:4]
+        self.assertEqual({'2012-10-01': ['CANCELS'], '2012-10-02': ['ORDERS', 'CANCELS']}, key_tables)
+        self.assertEqual(['CANCELS', 'ORDERS'], sorted(table_options))  # TRADES has all the groups already
+
+        self.assertEqual(['2012-10-01', '2012-10-02'], table_options['ORDERS']['hdf5_keys'])
+        self.assertEqual(30, table_options['ORDERS']['row_count'])
+        self.assertEqual(['ob_id'], table_options['ORDERS']['partition_by'])  # The layout of the existing files
+        self.assertEqual(PROFILE, table_options['ORDERS']['profile'])
+        self.assertEqual(6, table_options['CANCELS']['row_count'])
+        self.assertEqual(['day'], table_options['CANCELS']['partition_by'])
+        self.assertTrue(table_options['CANCELS']['append'])
+
+    def test_append_nothing_new(self):
+
+        """A file whose date groups are all imported already starts no jobs.
+        """
+        held = (['2012-10-01', '2012-10-02'], ['day'], None)
+        arrow_import = self.import_file({'AB00_ORDERS': held, 'AB00_CANCELS': held, 'AB00_TRADES': held})
+
+        self.assertFalse(arrow_import.called)
+
+    def test_stored_profile(self):
+
+        """An append in the spark mode writes with the profile of the existing tables, which have to share one.
+        """
+        layouts = {'AB00_ORDERS': (['2012-10-01'], ['day'], PROFILE), 'AB01_ORDERS': (['2012-10-01'], ['day'], dict(PROFILE))}
+        with patch.object(data_import, 'imported_layout', side_effect=lambda configstr, name: layouts.get(name, ([], None, None))):
+            self.assertEqual(PROFILE, data_import.stored_profile('{}', '/data/', ['/files/AB00.h5', '/files/AB01.h5'], {'name': 'small'}))
+            self.assertEqual({'name': 'small'}, data_import.stored_profile('{}', '/data/', ['/files/AB02.h5'], {'name': 'small'}))
+
+            layouts['AB01_ORDERS'] = (['2012-10-01'], ['day'], None)
+            self.assertRaises(RuntimeError, data_import.stored_profile, '{}', '/data/', ['/files/AB00.h5', '/files/AB01.h5'], None)
+
+    @patch('sparkles.modules.utils.helper.config_session')
+    @patch('sparkles.modules.utils.helper.get_dataset')
+    def test_imported_layout(self, get_dataset, config_session):
+
+        """The keys, partition columns and write profile of a dataset are read from its metadata.
+        """
+        get_dataset.return_value = Mock(hdf5_keys='["2012-10-01"]', partition_scheme='["day"]', write_profile='{"codec": "gzip"}')
+        self.assertEqual((['2012-10-01'], ['day'], {'codec': 'gzip'}), imported_layout('{}', 'AB00_ORDERS'))
+
+        get_dataset.return_value = Mock(hdf5_keys='[]', partition_scheme=None, write_profile=None)
+        self.assertEqual(([], [], None), imported_layout('{}', 'AB00_ORDERS'))  # Written before partitioning
+
+        get_dataset.return_value = None
+        self.assertEqual(([], None, None), imported_layout('{}', 'AB00_ORDERS'))
+
+        get_dataset.return_value = Mock(hdf5_keys=None)
+        self.assertRaises(RuntimeError, imported_layout, '{}', 'AB00_ORDERS')
+
+    @patch('sparkles.modules.utils.helper.upload_metadata')
+    @patch('sparkles.modules.utils.helper.shutil')
+    @patch('sparkles.modules.utils.helper.get_dataset')
+    def test_update_dataset(self, get_dataset, shutil_mock, upload_metadata):
+
+        """An appended dataset gets its new keys and row count after a backup of the metadata, which is then uploaded.
+        """
+        session = Mock()
+        config = {'METADATA_LOCAL_PATH': '/metadata/sqlite.db', 'BACKUP_METADATA_LOCAL_PATH': '/metadata/sqlite.db.backup'}
+        params = {'name': 'AB00_ORDERS', 'filepath': 'file:///data/AB00/AB00_ORDERS.parquet', 'schema': 'schema', 'hdf5_keys': '["2012-10-01", "2012-10-02"]',
+                  'row_count': 30, 'partition_scheme': '["day"]', 'write_profile': None}
+
+        update_dataset((session, config), params)
+        dataset = get_dataset.return_value
+        self.assertEqual('["2012-10-01", "2012-10-02"]', dataset.hdf5_keys)
+        self.assertEqual(30, dataset.row_count)
+        shutil_mock.copyfile.assert_called_once_with('/metadata/sqlite.db', '/metadata/sqlite.db.backup')
+        self.assertTrue(session.commit.called)
+        upload_metadata.assert_called_once_with(config)
+
+        get_dataset.return_value = None
+        self.assertRaises(RuntimeError, update_dataset, (session, config), params)
+
+
+class Spark_Layout_Tests(unittest.TestCase):
+
+    def test_prepare_layout(self):
+
+        """The day column is added for the day partitions and the rows are sorted by the partition and cluster columns.
+        """
+        dataframe = MagicMock()
+        dataframe.withColumn.return_value = dataframe
+
+        data_import.prepare_layout(dataframe, 'ORDERS', {'partition_by': ['day'], 'cluster_by': 'ob_id'})
+        self.assertEqual('day', dataframe.withColumn.call_args[0][0])
+        dataframe.sort.assert_called_once_with('day', 'ob_id', 'created')
+
+        dataframe = MagicMock()
+        self.assertEqual(dataframe, data_import.prepare_layout(dataframe, 'TRADES', {'partition_by': ['ob_id'], 'cluster_by': 'none'}))
+        self.assertFalse(dataframe.withColumn.called)
+        self.assertEqual(dataframe, data_import.prepare_layout(dataframe, 'TRADES', None))
+
+    @patch.object(data_import, 'rollup_granularity')
+    def test_rollup_options(self, rollup_granularity):
+
+        """A new table gets the asked rollup, a table with rows keeps the granularity of its rollup or stays without one.
+        """
+        rollup = data_import.rollup_options('{}', 'ORDERS', '/data/', '/files/AB00.h5', 1000, False, [], ['day', 'ob_id'], ['2012-10-01'])
+        self.assertEqual(1000, rollup['granularity'])
+        self.assertEqual('/data/AB00/AB00_ORDERS_ROLLUP.parquet', rollup['tablepath'])
+        self.assertEqual(['day'], rollup['partition_by'])
+        self.assertEqual(['AB00_ORDERS'], rollup['parents'])
+        self.assertEqual(None, data_import.rollup_options('{}', 'ORDERS', '/data/', '/files/AB00.h5', None, False, [], ['day'], ['2012-10-01']))
+
+        rollup_granularity.return_value = 60000
+        rollup = data_import.rollup_options('{}', 'ORDERS', '/data/', '/files/AB00.h5', 1000, True, ['2012-10-01'], ['ob_id'], ['2012-10-01', '2012-10-02'])
+        self.assertEqual(60000, rollup['granularity'])
+        self.assertEqual([], rollup['partition_by'])
+
+        rollup_granularity.return_value = None
+        self.assertEqual(None, data_import.rollup_options('{}', 'ORDERS', '/data/', '/files/AB00.h5', 1000, True, ['2012-10-01'], ['day'], ['2012-10-01']))
+
+    def test_write_profile(self):
+
+        """Profiles are given as dicts or by their name in IMPORT_PROFILES.
+        """
+        config = {'IMPORT_PROFILES': {'small': PROFILE}}
+
+        self.assertEqual(None, data_import.write_profile(config, None))
+        self.assertEqual({'codec': 'zstd'}, data_import.write_profile(config, {'codec': 'zstd'}))
+        self.assertEqual(dict(PROFILE, name='small'), data_import.write_profile(config, 'small'))
+        self.assertRaises(RuntimeError, data_import.write_profile, config, 'large')
+
+    def test_apply_write_profile(self):
+
+        """The codec, dictionary switch and writer version are set for the application, column lists are refused.
+        """
+        sc = Mock()
+        sqlContext = Mock()
+        hadoopConf = sc._jsc.hadoopConfiguration.return_value
+
+        data_import.apply_write_profile(sc, sqlContext, {'codec': 'gzip', 'dictionary': False, 'delta': True})
+        sqlContext.setConf.assert_called_once_with('spark.sql.parquet.compression.codec', 'gzip')
+        self.assertEqual([(('parquet.enable.dictionary', 'false'),), (('parquet.writer.version', 'PARQUET_2_0'),)], hadoopConf.set.call_args_list)
+
+        hadoopConf.reset_mock()
+        self.assertRaises(RuntimeError, data_import.apply_write_profile, sc, sqlContext, {'dictionary': ['side']})
+        self.assertFalse(hadoopConf.set.called)
+
+        data_import.apply_write_profile(sc, sqlContext, None)
+        self.assertFalse(hadoopConf.set.called)
@@ -0,0 +1,41 @@
+import unittest
+from sparkles.modules.utils.intervals import table_name, rollup_fits, parse_intervals, count_columns
+
+
+class Intervals_Tests(unittest.TestCase):
+
+    def test_table_name(self):
+
+        """The table is the suffix of the imported dataset name, also for directories and URIs.
+        """
+        self.assertEqual('ORDERS', table_name('hdfs://host:8020/files/AB00/AB00_ORDERS.parquet'))
+        self.assertEqual('TRADES', table_name('file:///files/AB00/AB00_trades.parquet/'))
+        self.assertEqual('CANCELS', table_name('AB00_2012_CANCELS'))
+
+    def test_parse_intervals(self):
+
+        """The intervals are sorted from the finest without duplicates and every one is a multiple of the finest.
+        """
+        self.assertEqual([1000.0], parse_intervals(1000))
+        self.assertEqual([1000.0, 10000.0, 60000.0], parse_intervals([60000, 1000, 10000, 1000]))
+        self.assertRaises(RuntimeError, parse_intervals, [1000, 1500])
+        self.assertRaises(RuntimeError, parse_intervals, [60000, 45000])
+
+    def test_rollup_fits(self):
+
+        """The rollup is used only when the window and every interval are aligned to its granularity.
+        """
+        rollup = ('file:///files/AB00/AB00_ORDERS_ROLLUP.parquet', 1000)
+        self.assertTrue(rollup_fits(rollup, [1000.0, 60000.0], 1349168400000, 1349172000000))
+        self.assertFalse(rollup_fits(rollup, [500.0, 1000.0], 1349168400000, 1349172000000))
+        self.assertFalse(rollup_fits(rollup, [1000.0], 1349168400500, 1349172000000))
+        self.assertFalse(rollup_fits(rollup, [1000.0], 1349168400000, 1349172000001))
+        self.assertFalse(rollup_fits(None, [1000.0], 1349168400000, 1349172000000))
+
+    def test_count_columns(self):
+
+        """A single interval on a single input keeps the timestamp and count featureset.
+        """
+        self.assertEqual(['timestamp', 'count'], count_columns([1000.0], ['AB00_ORDERS']))
+        self.assertEqual(['table', 'interval', 'timestamp', 'count'], count_columns([1000.0, 60000.0], ['AB00_ORDERS']))
+        self.assertEqual(['table', 'interval', 'timestamp', 'count'], count_columns([1000.0], ['AB00_ORDERS', 'AB00_TRADES']))
@@ -0,0 +1,38 @@
+import unittest
+import sys
+import threading
+from sparkles.modules.utils.runner import AnalysisJob
+
+
+class Jobs_Tests(unittest.TestCase):
+
+    def test_job_output_and_exit_code(self):
+
+        """A job keeps the output and exit code of its process.
+        """
+        slots = threading.BoundedSemaphore(2)
+        succeeding = AnalysisJob('ok', [sys.executable, '-c', 'print("counted")'], slots)
+        failing = AnalysisJob('broken', [sys.executable, '-c', 'import sys; sys.exit(3)'], slots)
+
+        self.assertEqual(0, succeeding.wait(30))
+        self.assertEqual(3, failing.wait(30))
+        self.assertEqual('succeeded', succeeding.status)
+        self.assertEqual('failed', failing.status)
+        self.assertIn(b'counted', succeeding.logs())
+        self.assertTrue(succeeding.done())
+        self.assertTrue(succeeding.elapsed() >= 0)
+
+    def test_concurrency_limit(self):
+
+        """Jobs beyond the number of slots wait in the queue until a running job has finished.
+        """
+        slots = threading.BoundedSemaphore(1)
+        slots.acquire()  # Taken as if by a running job
+        job = AnalysisJob('queued', [sys.executable, '-c', 'pass'], slots)
+
+        self.assertFalse(job.finished_event.wait(0.5))
+        self.assertEqual('queued', job.status)
+        self.assertEqual(None, job.elapsed())
+
+        slots.release()
+        self.assertEqual(0, job.wait(30))
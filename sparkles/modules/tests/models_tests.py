@@ -0,0 +1,41 @@
+import unittest
+import os
+import sqlite3
+import tempfile
+from mock import patch
+from sparkles.modules.utils import models
+from sparkles.modules.utils.models import Base, config_to_db_session, add_missing_columns, Dataset
+
+
+class Models_Tests(unittest.TestCase):
+
+    def setUp(self):
+
+        handle, self.dbpath = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        db = sqlite3.connect(self.dbpath)
+        db.execute('CREATE TABLE datasets (id VARCHAR(32) NOT NULL, name VARCHAR(100), filepath VARCHAR(500) NOT NULL, PRIMARY KEY (id))')  # A metadata file of an older version
+        db.commit()
+        db.close()
+
+    def tearDown(self):
+
+        models.engines.pop('sqlite:///' + self.dbpath, None)
+        os.remove(self.dbpath)
+
+    @patch('sparkles.modules.utils.models.add_missing_columns', wraps=add_missing_columns)
+    def test_upgrade_once_per_engine(self, upgrade):
+
+        """The missing columns of an older metadata file are added with their indexes, once for the sessions of an engine.
+        """
+        session = config_to_db_session('sqlite:///' + self.dbpath, Base)
+        self.assertEqual(0, session.query(Dataset).filter_by(cache_key='abc').count())
+        config_to_db_session('sqlite:///' + self.dbpath, Base)
+        self.assertEqual(1, upgrade.call_count)
+
+        db = sqlite3.connect(self.dbpath)
+        columns = [row[1] for row in db.execute('PRAGMA table_info(datasets)')]
+        indexes = [row[1] for row in db.execute('PRAGMA index_list(datasets)')]
+        db.close()
+        self.assertIn('cache_key', columns)
+        self.assertIn('ix_datasets_cache_key', indexes)
@@ -0,0 +1,24 @@
+import unittest
+from sparkles.modules.utils.partitioning import pack_keys
+
+
+class Partitioning_Tests(unittest.TestCase):
+
+    def test_pack_keys(self):
+
+        """Used to test the size aware distribution of the HDF5 date keys over the import tasks.
+        """
+        sizes = [('2012-10-01', 50), ('2012-10-02', 10), ('2012-10-03', 10), ('2012-10-04', 20), ('2012-10-05', 10)]
+        bins = pack_keys(sizes, 2)
+
+        self.assertEqual(2, len(bins))
+        self.assertEqual(sorted(k for k, s in sizes), sorted(k for b in bins for k in b))  # Every key exactly once
+        self.assertEqual([['2012-10-01'], ['2012-10-04', '2012-10-02', '2012-10-03', '2012-10-05']], bins)  # The busy day gets its own task
+
+    def test_pack_keys_few_keys(self):
+
+        """No empty bins when there are less keys than partitions
+        """
+        self.assertEqual([['b'], ['a']], pack_keys([('a', 1), ('b', 2)], 8))
+        self.assertEqual([['b', 'a']], pack_keys([('a', 1), ('b', 2)], 0))
+        self.assertEqual([], pack_keys([], 4))
@@ -0,0 +1,193 @@
+import unittest
+import json
+import os
+import shutil
+import tempfile
+from mock import Mock, patch
+from sparkles.modules.utils.models import Dataset, Analysis
+from sparkles.modules.utils.runner import SparkRunner, AnalysisJob
+
+RECORDING_MODULE = '''
+def module_implementation(sc, sqlContext, params=None, inputs=None, features=None):
+    return (sc, sqlContext, params, inputs, features)
+'''
+
+
+class Session_Tests(unittest.TestCase):
+
+    def setUp(self):
+
+        self.moduledir = tempfile.mkdtemp()
+        with open(os.path.join(self.moduledir, 'recording.py'), 'w') as module_file:
+            module_file.write(RECORDING_MODULE)
+
+        # A runner with a running session, without reading a config or starting Spark
+        self.runner = SparkRunner.__new__(SparkRunner)
+        self.runner.config = {'BACKEND': 'nfs', 'MODULES_DIR_LOCAL': self.moduledir + '/', 'FEATURES_DIR': '/features/', 'SHUFFLE_PARTITIONS': 4}
+        self.runner.backend = 'nfs'
+        self.runner.configstr = '{}'
+        self.runner.sc = Mock()
+        self.runner.sqlContext = Mock()
+        self.runner.cached_datasets = {}
+        self.runner.job_slots = Mock()
+
+        found = {Analysis: Mock(filepath='recording.py'), Dataset: Mock(filepath='file:///files/AB00_ORDERS', id='ab00', row_count=100)}
+        self.featuresets = {}  # Featuresets by cache key
+        self.runner.session = Mock()
+        self.runner.session.query.side_effect = lambda model: Mock(**{
+            'from_statement.return_value.params.return_value.first.return_value': found[model],
+            'filter_by.return_value.first.return_value': found[model],
+            'filter_by.side_effect': lambda **kwargs: Mock(**{'first.return_value': found[model], 'order_by.return_value.first.return_value': self.featuresets.get(kwargs.get('cache_key'))})})
+
+    def tearDown(self):
+
+        shutil.rmtree(self.moduledir)
+
+    @patch('sparkles.modules.utils.runner.call')
+    def test_run_analysis_in_session(self, call):
+
+        """With a running session the module is called in process with the session contexts instead of launching pyspark.
+        """
+        sc, sqlContext, params, inputs, features = self.runner.run_analysis(modulename='recording', params={'interval': 60000}, inputs=['AB00_ORDERS'], features={'featureset_name': 'feat'})
+
+        self.assertFalse(call.called)
+        self.assertEqual(self.runner.sc, sc)
+        self.assertEqual(self.runner.sqlContext, sqlContext)
+        self.assertEqual({'interval': 60000}, params)
+        self.assertEqual(['file:///files/AB00_ORDERS'], inputs)
+        self.assertEqual('file:///features/', features['userdatadir'])
+        self.assertEqual('recording', features['modulename'])
+
+    @patch('sparkles.modules.utils.runner.call')
+    def test_configstr_without_features(self, call):
+
+        """The module gets the metadata config also when no featureset is saved, in a session and on the command line.
+        """
+        features = self.runner.run_analysis(modulename='recording', params={'interval': 60000}, inputs=['AB00_ORDERS'])[4]
+        self.assertEqual({'configstr': '{}'}, features)
+
+        self.runner.clusterUrl = 'local[*]'
+        self.runner.config['PYSPARK_CLIENT_PATH'] = 'pyspark'
+        command = self.runner.analysis_command('recording', 'recording.py', {'interval': 60000}, ['file:///files/AB00_ORDERS'], None)
+        self.assertEqual('{"configstr": "{}"}', command[-1])
+
+    @patch('sparkles.modules.utils.runner.call')
+    def test_reuse_featureset(self, call):
+
+        """A run with the same module, params and inputs as a saved featureset returns it unless it is forced.
+        """
+        features = self.runner.run_analysis(modulename='recording', params={'interval': 60000}, inputs=['AB00_ORDERS'], features={'featureset_name': 'feat'})[4]
+        self.featuresets[features['cache_key']] = Mock(filepath='file:///features/feat.parquet')
+        self.featuresets[features['cache_key']].name = 'feat'
+
+        result = self.runner.run_analysis(modulename='recording', params={'interval': 60000}, inputs=['AB00_ORDERS'], features={'featureset_name': 'feat2'})
+        self.assertEqual(self.runner.sqlContext.read.parquet.return_value, result)
+        self.runner.sqlContext.read.parquet.assert_called_with('file:///features/feat.parquet')
+
+        forced = self.runner.run_analysis(modulename='recording', params={'interval': 60000}, inputs=['AB00_ORDERS'], features={'featureset_name': 'feat3'}, force=True)
+        self.assertEqual('feat3', forced[4]['featureset_name'])
+
+        other = self.runner.run_analysis(modulename='recording', params={'interval': 1000}, inputs=['AB00_ORDERS'], features={'featureset_name': 'feat4'})
+        self.assertEqual('feat4', other[4]['featureset_name'])
+
+    @patch('sparkles.modules.utils.runner.call')
+    def test_test_analysis_in_session(self, call):
+
+        """The module under test runs in the session too and does not save a featureset.
+        """
+        features = self.runner.test_analysis(modulepath=os.path.join(self.moduledir, 'recording.py'), params={}, inputs=['AB00_ORDERS'])[4]
+
+        self.assertFalse(call.called)
+        self.assertTrue(features['module_testing'])
+        self.assertEqual('{}', features['configstr'])
+
+    @patch('sparkles.modules.utils.runner.call')
+    def test_run_analysis_batch_in_session(self, call):
+
+        """The runs of a batch share the inputs which are cached for the batch and released after it.
+        """
+        runs = [({'interval': 1000}, {'featureset_name': 'feat_1000'}), ({'interval': 60000}, None)]
+        results = self.runner.run_analysis_batch(modulename='recording', runs=runs, inputs=['AB00_ORDERS'])
+
+        self.assertFalse(call.called)
+        self.assertEqual([{'interval': 1000}, {'interval': 60000}], [result[2] for result in results])
+        self.assertEqual('feat_1000', results[0][4]['featureset_name'])
+        self.assertEqual({'configstr': '{}'}, results[1][4])  # The metadata config without a featureset to save
+        self.assertTrue(self.runner.sqlContext.read.parquet.return_value.cache.called)
+        self.assertTrue(self.runner.sqlContext.read.parquet.return_value.unpersist.called)
+        self.assertEqual({}, self.runner.cached_datasets)
+
+    @patch('sparkles.modules.utils.runner.call')
+    def test_run_analysis_batch_exit_code(self, call):
+
+        """Without a session the batch runs in pyspark and its exit code is returned, also when some runs failed.
+        """
+        self.runner.sc = None
+        self.runner.clusterUrl = 'local[*]'
+        self.runner.config['PYSPARK_CLIENT_PATH'] = 'pyspark'
+        call.return_value = 1
+
+        runs = [({'interval': 1000}, None), ({'interval': 60000}, None)]
+        self.assertEqual(1, self.runner.run_analysis_batch(modulename='recording', runs=runs, inputs=['AB00_ORDERS']))
+        self.assertTrue(call.call_args[0][0][1].endswith('/batch_analysis.py'))
+
+    @patch('sparkles.modules.utils.runner.call')
+    def test_reuse_featureset_in_batch_and_submit(self, call):
+
+        """The batch runs and submitted analyses stamp the cache key and reuse the featuresets of the same runs too.
+        """
+        features = self.runner.run_analysis(modulename='recording', params={'interval': 60000}, inputs=['AB00_ORDERS'], features={'featureset_name': 'feat'})[4]
+        self.featuresets[features['cache_key']] = Mock(filepath='file:///features/feat.parquet')
+        self.featuresets[features['cache_key']].name = 'feat'
+
+        runs = [({'interval': 1000}, {'featureset_name': 'feat_1000'}), ({'interval': 60000}, {'featureset_name': 'feat_60000'})]
+        results = self.runner.run_analysis_batch(modulename='recording', runs=runs, inputs=['AB00_ORDERS'])
+        self.assertIn('cache_key', results[0][4])
+        self.assertEqual(self.runner.sqlContext.read.parquet.return_value, results[1])
+
+        self.runner.sc = None
+        self.runner.clusterUrl = 'local[*]'
+        self.runner.config['PYSPARK_CLIENT_PATH'] = 'pyspark'
+        call.return_value = 0
+        self.runner.run_analysis_batch(modulename='recording', runs=runs, inputs=['AB00_ORDERS'])
+        self.assertEqual(['feat_1000'], [run[1]['featureset_name'] for run in json.loads(call.call_args[0][0][-2])])
+
+        call.reset_mock()
+        self.assertEqual(0, self.runner.run_analysis_batch(modulename='recording', runs=runs[1:], inputs=['AB00_ORDERS']))
+        self.assertFalse(call.called)
+
+        job = self.runner.submit_analysis(modulename='recording', params={'interval': 60000}, inputs=['AB00_ORDERS'], features={'featureset_name': 'feat5'})
+        self.assertTrue(isinstance(job, AnalysisJob))
+        self.assertEqual(0, job.wait(0))
+        self.assertEqual('succeeded', job.status)
+        self.assertIn(b'feat', job.logs())
+
+    @patch('sparkles.modules.utils.runner.call')
+    def test_reuse_featureset_name(self, call):
+
+        """Without a session a reused featureset is returned by its name, no module runs for the new name.
+        """
+        features = self.runner.run_analysis(modulename='recording', params={'interval': 60000}, inputs=['AB00_ORDERS'], features={'featureset_name': 'feat'})[4]
+        self.featuresets[features['cache_key']] = Mock(filepath='file:///features/feat.parquet')
+        self.featuresets[features['cache_key']].name = 'feat'
+
+        self.runner.sc = None
+        self.assertEqual('feat', self.runner.run_analysis(modulename='recording', params={'interval': 60000}, inputs=['AB00_ORDERS'], features={'featureset_name': 'feat2'}))
+        self.assertFalse(call.called)
+
+    @patch('sparkles.modules.utils.runner.upload_metadata')
+    @patch('sparkles.modules.utils.runner.shutil')
+    def test_invalidate_cache_uploaded(self, shutil_mock, upload_metadata):
+
+        """The invalidated cache keys are committed after a backup and the metadata is uploaded to the backend.
+        """
+        featureset = Mock(cache_key='abc')
+        self.runner.session = Mock(**{'query.return_value.filter.return_value.filter_by.return_value.all.return_value': [featureset]})
+        self.runner.config['METADATA_LOCAL_PATH'] = '/metadata/sqlite.db'
+        self.runner.backup_metadata_path = '/metadata/sqlite.db.backup'
+
+        self.assertEqual(1, self.runner.invalidate_cache(featureset_name='feat'))
+        self.assertEqual(None, featureset.cache_key)
+        shutil_mock.copyfile.assert_called_once_with('/metadata/sqlite.db', '/metadata/sqlite.db.backup')
+        self.assertTrue(self.runner.session.commit.called)
+        upload_metadata.assert_called_once_with(self.runner.config)
@@ -0,0 +1,56 @@
+import unittest
+import os
+import sys
+import shutil
+import zipfile
+import subprocess
+from mock import Mock
+from sparkles.modules.utils.helper import ship_modules, ANALYSIS_MODULES
+
+MODULES_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# Imports the names from the shipped zip in a new interpreter which has only the zip of the sparkles code, like an executor,
+# and returns the sparkles modules it loaded (python 2 keeps None entries for the implicit relative imports it tried)
+def import_shipped(zippath, statement):
+
+    script = "import sys; sys.path.insert(0, sys.argv[1]); " + statement + "; print(sorted(m for m, module in sys.modules.items() if module is not None and m.split('.')[0] in ('utils', 'sparkles')))"
+    return subprocess.check_output([sys.executable, '-c', script, zippath], cwd=os.path.dirname(zippath)).decode().strip()
+
+
+class Ship_Modules_Tests(unittest.TestCase):
+
+    def setUp(self):
+
+        self.sc = Mock()
+        self.zippaths = []
+
+    def tearDown(self):
+
+        for zippath in self.zippaths:
+            shutil.rmtree(os.path.dirname(zippath))
+
+    def ship(self, package, modulenames):
+
+        zippath = ship_modules(self.sc, MODULES_DIR, package, modulenames)
+        self.zippaths.append(zippath)
+        return zippath
+
+    def test_ship_import_modules(self):
+
+        """The import executors get the tables module as utils.tables without the rest of the helpers.
+        """
+        zippath = self.ship('utils', ['tables'])
+
+        self.sc.addPyFile.assert_called_once_with(zippath)
+        self.assertEqual(['utils/__init__.py', 'utils/tables.py'], sorted(zipfile.ZipFile(zippath).namelist()))
+        self.assertEqual("['utils', 'utils.tables']", import_shipped(zippath, 'from utils.tables import iter_hdf5_chunks, check_narrowed'))
+
+    def test_ship_analysis_modules(self):
+
+        """The analysis executors get the depth helpers by their sparkles package name, with the tables module they import.
+        """
+        zippath = self.ship('sparkles.modules.utils', ANALYSIS_MODULES)
+
+        self.assertEqual(['sparkles/__init__.py', 'sparkles/modules/__init__.py', 'sparkles/modules/utils/__init__.py', 'sparkles/modules/utils/depth.py', 'sparkles/modules/utils/tables.py'], sorted(zipfile.ZipFile(zippath).namelist()))
+        self.assertIn("'sparkles.modules.utils.depth'", import_shipped(zippath, 'from sparkles.modules.utils.depth import insert_side, merge_sides, sweep_depth'))
@@ -0,0 +1,150 @@
+import unittest
+import os
+import json
+import shutil
+import sys
+import tempfile
+import subprocess
+import h5py
+import numpy as np
+from mock import Mock
+from sparkles.modules.utils.helper import ship_modules
+from sparkles.modules.utils.tables import SCHEMA_STRINGS, LONG_FIELDS, TABLES, DAY_MS, pa, check_narrowed, arrow_write_options, partition_groups, write_arrow_tables
+
+MODULES_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+T0 = 1349168400000  # 2012-10-02 09:00 UTC
+DAY = T0 // DAY_MS
+
+
+def table_dtype(table):
+
+    return [(name, '<i8' if name in LONG_FIELDS[table] else '<i4') for name in SCHEMA_STRINGS[table].split()]
+
+
+# One date group of a small order book file: four orders of two books, one cancel and one trade
+def write_fixture(filepath):
+
+    orders = np.zeros(4, dtype=table_dtype('ORDERS'))
+    orders['id'] = [1, 2, 3, 4]
+    orders['ob_id'] = [7, 8, 7, 7]
+    orders['created'] = [T0 + 1500, T0 + 200, T0 + 100, T0 + 1200]
+    orders['side'] = [66, 83, 66, 83]
+    orders['price'] = [100, 101, 99, 102]
+    orders['quantity'] = [5, 3, 2, 1]
+
+    cancels = np.zeros(1, dtype=table_dtype('CANCELS'))
+    cancels['ob_id'] = 7
+    cancels['timestamp'] = T0 + 300
+    trades = np.zeros(1, dtype=table_dtype('TRADES'))
+    trades['ob_id'] = 8
+    trades['timestamp'] = T0 + 400
+
+    with h5py.File(filepath, 'w') as f:
+        group = f.create_group('2012-10-02')
+        for table, data in [('ORDERS', orders), ('CANCELS', cancels), ('TRADES', trades)]:
+            group.create_dataset(table, data=data)
+
+
+# The rows of the part files under the dataset directory as dicts, by their partition directory
+def read_parts(tablepath):
+
+    parts = {}
+    for directory, _, filenames in os.walk(tablepath):
+        for filename in sorted(filenames):
+            columns = pa.parquet.read_table(os.path.join(directory, filename)).to_pydict()
+            rows = [dict(zip(columns, values)) for values in zip(*columns.values())]
+            parts.setdefault(os.path.relpath(directory, tablepath), []).extend(rows)
+    return parts
+
+
+@unittest.skipIf(pa is None, 'The arrow import mode needs pyarrow')
+class Tables_Tests(unittest.TestCase):
+
+    def setUp(self):
+
+        import pyarrow.parquet  # noqa: F401, read_parts reads the part files with it
+
+        self.workdir = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.workdir, 'AB00.h5')
+        write_fixture(self.filepath)
+
+    def tearDown(self):
+
+        shutil.rmtree(self.workdir)
+
+    def table_options(self, partition_by, profile=None, rollup=None):
+
+        options = {'partition_by': partition_by, 'cluster_by': 'time', 'row_group_size': None, 'profile': profile}
+        if(rollup):
+            options['rollup'] = rollup
+        return dict((table, dict(options)) for table in TABLES)
+
+    def test_partition_groups(self):
+
+        """The rows of every partition keep their order, the partition columns are in the directory names.
+        """
+        values = [('day', np.array([5, 5, 6, 5])), ('ob_id', np.array([1, 2, 1, 1]))]
+        groups = [(directory, list(indexes)) for directory, indexes in partition_groups(values, 4)]
+
+        self.assertEqual([('day=5/ob_id=1', [0, 3]), ('day=5/ob_id=2', [1]), ('day=6/ob_id=1', [2])], groups)
+        self.assertEqual([('', [0, 1, 2])], [(directory, list(indexes)) for directory, indexes in partition_groups([], 3)])
+
+    def test_import_arrow(self):
+
+        """The chunks of the HDF5 tables are written as Parquet part files in the partition directories, sorted by time.
+        """
+        tablepaths = dict((table, 'file://' + os.path.join(self.workdir, 'AB00', 'AB00_' + table + '.parquet')) for table in TABLES)
+        rollup = {'granularity': 1000, 'partition_by': ['day'], 'tablepath': 'file://' + os.path.join(self.workdir, 'AB00', 'AB00_ORDERS_ROLLUP.parquet')}
+        table_options = self.table_options(['day', 'ob_id'])
+        table_options['ORDERS']['rollup'] = rollup
+
+        write_arrow_tables('2012-10-02', self.filepath, tablepaths, table_options, chunk_size=3)
+
+        orders = read_parts(tablepaths['ORDERS'][len('file://'):])
+        directory = 'day=' + str(DAY) + '/ob_id=7'
+        self.assertEqual([directory, 'day=' + str(DAY) + '/ob_id=8'], sorted(orders))
+        self.assertEqual([T0 + 100, T0 + 1500, T0 + 1200], [row['created'] for row in orders[directory]])  # Two chunks
+        self.assertNotIn('day', orders[directory][0])
+        self.assertEqual(['day=' + str(DAY) + '/ob_id=7'], sorted(read_parts(tablepaths['CANCELS'][len('file://'):])))
+
+        counts = read_parts(rollup['tablepath'][len('file://'):])
+        self.assertEqual([(7, T0, 1), (7, T0 + 1000, 1), (8, T0, 1), (7, T0 + 1000, 1)], [(row['ob_id'], row['timestamp'], row['count']) for row in counts['day=' + str(DAY)]])
+
+    def test_narrowed_types(self):
+
+        """Narrowed columns are written with their type, values out of the range of the type fail the import.
+        """
+        tablepaths = dict((table, 'file://' + os.path.join(self.workdir, 'AB00_' + table + '.parquet')) for table in TABLES)
+        write_arrow_tables('2012-10-02', self.filepath, tablepaths, self.table_options([], {'types': {'side': 'byte', 'is_round': 'byte'}}))
+
+        schema = pa.parquet.read_table(os.path.join(self.workdir, 'AB00_ORDERS.parquet', 'part-2012-10-02-0.parquet')).schema
+        self.assertEqual(pa.int8(), schema.field_by_name('side').type)
+        self.assertEqual(pa.int64(), schema.field_by_name('created').type)
+
+        with h5py.File(self.filepath, 'r') as f:
+            orders = f['2012-10-02']['ORDERS'][:]
+        check_narrowed(orders, 'ORDERS', {'types': {'price': 'byte'}})
+        orders['price'][0] = 1000
+        self.assertRaises(RuntimeError, check_narrowed, orders, 'ORDERS', {'types': {'price': 'byte'}})
+
+    def test_delta_refused(self):
+
+        """The arrow writer can not delta encode, so the write profiles with delta are refused.
+        """
+        self.assertEqual({'compression': 'gzip', 'use_dictionary': ['side'], 'row_group_size': 888}, arrow_write_options('CANCELS', {'profile': {'codec': 'gzip', 'dictionary': ['side']}, 'row_group_size': 32000}))
+        self.assertRaises(RuntimeError, arrow_write_options, 'ORDERS', {'profile': {'delta': True}})
+
+    def test_import_arrow_shipped(self):
+
+        """The arrow writer runs from the modules shipped to the executors, without the sparkles package.
+        """
+        zippath = ship_modules(Mock(), MODULES_DIR, 'utils', ['tables'])
+        tablepaths = dict((table, 'file://' + os.path.join(self.workdir, 'AB00_' + table + '.parquet')) for table in TABLES)
+        script = "import sys, json; sys.path.insert(0, sys.argv[1]); from utils.tables import write_arrow_tables; write_arrow_tables('2012-10-02', sys.argv[2], json.loads(sys.argv[3]), json.loads(sys.argv[4]))"
+        try:
+            subprocess.check_call([sys.executable, '-c', script, zippath, self.filepath, json.dumps(tablepaths), json.dumps(self.table_options(['day']))], cwd=self.workdir)
+        finally:
+            shutil.rmtree(os.path.dirname(zippath))
+
+        self.assertEqual(['day=' + str(DAY)], sorted(read_parts(tablepaths['TRADES'][len('file://'):])))
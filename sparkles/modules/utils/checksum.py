@@ -0,0 +1,20 @@
+import hashlib
+import json
+
+
+# SHA-256 of the content of a file, read in blocks so that large files are not loaded at once
+def file_checksum(filepath, block_size=1048576):
+
+    sha = hashlib.sha256()
+    with open(filepath, 'rb') as hashed_file:
+        for block in iter(lambda: hashed_file.read(block_size), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+# The key of an analysis run: the same module content, parameters and input datasets give the same key
+# The parameters are serialized with sorted keys so that the order of the dict does not change the key
+def cache_key(module_checksum, params, inputs):
+
+    canonical = json.dumps({'module': module_checksum, 'params': params, 'inputs': inputs}, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
@@ -0,0 +1,123 @@
+from bisect import insort
+from heapq import merge
+from tables import DAY_MS
+
+SIDES = {66: 0, 83: 1}  # Buy and sell, the index of the side in the curves of a timestamp
+
+# The end of the day of created as epoch milliseconds: the day in the session time zone taken as a UTC date
+EFFECTIVE_DESTROYED = "CASE WHEN destroyed = 0 THEN CAST(datediff(to_date(from_unixtime(CAST(created / 1000 AS BIGINT))), to_date('1970-01-01')) AS BIGINT) * " + str(DAY_MS) + " + " + str(DAY_MS - 1) + " ELSE destroyed END"
+
+
+# Index of the first sample timestamp (start_time + k * interval) at or after t, ceil((t - start_time) / interval) in integers
+def sample_index(t, start_time, interval):
+
+    return -((start_time - t) // interval)
+
+
+# The same as a SQL expression of a time column
+def sample_sql(column, start_time, interval):
+
+    return "CAST(CEIL(CAST(" + column + " - " + str(start_time) + " AS DOUBLE) / " + str(interval) + ") AS BIGINT)"
+
+
+# The orders of the table which are on the book at some point from the since time to the end time. Orders which stay on
+# the book until the end of the day have destroyed 0, which is replaced with the last millisecond of the day of created.
+# The raw destroyed condition can be pushed down to Parquet, the effective one leaves out the orders of earlier days
+def select_orders_sql(table, since, end_time, ob_id=None, day_partitioned=False):
+
+    query = "SELECT ob_id, created, " + EFFECTIVE_DESTROYED + " AS destroyed, side, price, quantity FROM " + table
+    query += " WHERE created <=" + str(end_time) + " AND (destroyed >" + str(since) + " OR destroyed = 0)"
+    query += " AND " + EFFECTIVE_DESTROYED + " >" + str(since)
+    query += " AND side IN (" + ', '.join(str(side) for side in sorted(SIDES)) + ")"
+    if(ob_id is not None):
+        query += " AND ob_id =" + str(int(ob_id))
+    if(day_partitioned):  # Orders live at most until the end of their trading day, the extra day covers the timezone offset
+        query += " AND day >=" + str(since // DAY_MS - 1) + " AND day <=" + str(end_time // DAY_MS)
+    return query
+
+
+# The depth changes of the selected orders as rows of the level columns, the sample and the change.
+# An order is on the book at the samples created <= ts < destroyed, so it only changes the depth of its level twice:
+# +qty at the first sample at or after created and -qty at the first sample at or after destroyed.
+# With a checkpoint, the orders created before it and still on the book after it are already in its state and only leave
+def order_deltas_sql(table, level_columns, start_time, interval, samples, checkpoint_time=None):
+
+    levels = ', '.join(level_columns)
+    first = "GREATEST(" + sample_sql('created', start_time, interval) + ", 0)"
+    last = sample_sql('destroyed', start_time, interval)
+
+    entering = "true"
+    leaving = first + " < " + last
+    if(checkpoint_time is not None):
+        entering = "created > " + str(checkpoint_time)
+        leaving = "(" + entering + " AND " + leaving + ") OR (created <= " + str(checkpoint_time) + " AND destroyed > " + str(checkpoint_time) + ")"
+
+    query = "SELECT " + levels + ", " + first + " AS sample, CAST(quantity AS BIGINT) AS change FROM " + table + " WHERE " + first + " < LEAST(" + last + ", " + str(samples) + ") AND " + entering
+    query += " UNION ALL SELECT " + levels + ", GREATEST(" + last + ", 0) AS sample, -CAST(quantity AS BIGINT) AS change FROM " + table + " WHERE GREATEST(" + last + ", 0) < " + str(samples) + " AND (" + leaving + ")"
+    return query
+
+
+# Replays the depth changes of one level (sorted by sample) and yields the depth at every sample where the level is not empty
+def sweep_depth(start_time, interval, samples):
+    def _sweep_depth(level, deltas):
+        depth = 0
+        previous = 0
+        for k, delta in deltas:  # The same sample may come twice, from the orders and a checkpoint
+            if(depth != 0):
+                for j in xrange(previous, k):
+                    yield start_time + j * interval, (level, depth)
+            depth += delta
+            previous = k
+        if(depth != 0):  # Orders still alive at the end of the window
+            for j in xrange(previous, samples):
+                yield start_time + j * interval, (level, depth)
+
+    return _sweep_depth
+
+
+# Combiners which keep the values of a key in a sorted list. The lists are built within each partition before the shuffle
+# and merged after it, so only one list per key and partition is shuffled and no separate sort is needed
+def insert_sorted(values, value):
+
+    insort(values, value)
+    return values
+
+
+def merge_sorted(values1, values2):
+
+    return list(merge(values1, values2))
+
+
+# The same for the pair of buy and sell lists of a timestamp, the values are ((side, price), depth)
+def insert_side(curves, value):
+
+    insort(curves[SIDES[value[0][0]]], [value[0][1], value[1]])
+    return curves
+
+
+def merge_sides(curves1, curves2):
+
+    return [merge_sorted(curves1[0], curves2[0]), merge_sorted(curves1[1], curves2[1])]
+
+
+# The curves of a timestamp as parallel arrays of prices and depths per side instead of [price, depth] pairs, which
+# Parquet stores as four plain int columns. With delta_prices every price after the first is the step from the previous
+# one: the prices are sorted so the steps are small positive numbers which the Parquet encodings pack in a few bits
+def parallel_curves(curve, delta_prices=False):
+
+    prices = [pair[0] for pair in curve]
+    depths = [pair[1] for pair in curve]
+    if(delta_prices):
+        prices = prices[:1] + [b - a for a, b in zip(prices, prices[1:])]
+    return prices, depths
+
+
+# The prices of a delta encoded curve back as absolute prices
+def decode_prices(prices):
+
+    decoded = []
+    price = 0
+    for step in prices:
+        price += step
+        decoded.append(price)
+    return decoded
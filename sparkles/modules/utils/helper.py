@@ -8,6 +8,7 @@ import os
 from os.path import dirname
 import errno
 from models import Base, config_to_db_session, fs_to_ds, Dataset, Analysis
+from tables import iter_hdf5_chunks
 from sqlalchemy import text
 from swiftclient.service import SwiftService, SwiftUploadObject
 import shutil
@@ -15,28 +16,67 @@ import json
 import socket
 from snakebite.client import Client
 import subprocess
+import threading
+import tempfile
+import zipfile
 
+PREVIEW_ROWS = 20  # Rows of a module result printed on the driver
 
-def import_hdf5(x, filepath, table):
+metadata_lock = threading.Lock()  # Serializes the metadata updates of an application importing several files at once
+
+
+def import_hdf5(x, filepath, table, chunk_size=100000):
 
     with h5py.File(filepath) as f:
         data = f[str(x)].get(table)
-        return list(data[:])
+        for chunk in iter_hdf5_chunks(data, chunk_size):
+            for row in chunk:
+                yield row
 
 
-def saveDataset(configstr, dataframe, userdatadir, tablename, originalpath, description, details):
+def dataset_location(userdatadir, tablename, originalpath):
 
     p = re.compile('.+/(\w+)\.\w+')
     m = p.match(originalpath)
     identifier = m.group(1)
 
-    created = datetime.now()
-    user = getpass.getuser()
-
     filedir = userdatadir + identifier  # This assumes you already have a trailing forward slash in the userdatadir parameter
     filename = identifier + '_' + tablename.upper()
     tablepath = filedir + '/' + filename + '.parquet'
 
+    return (identifier, filename, tablepath)
+
+
+def saveDataset(configstr, dataframe, userdatadir, tablename, originalpath, description, details, options=None):
+
+    if(options is None):
+        options = {}
+    tablepath = dataset_location(userdatadir, tablename, originalpath)[2]
+
+    try:
+        writer = dataframe.write
+        if(options.get('append')):
+            writer = writer.mode('append')
+        if(options.get('partition_by')):
+            writer = writer.partitionBy(*options['partition_by'])
+        writer.parquet(tablepath)
+    except Exception as e:
+        raise RuntimeError(e)
+
+    registerDataset(configstr, dataframe, userdatadir, tablename, originalpath, description, details, options)
+
+
+# Creates the metadata entry of a table that has already been written to its location
+# In append mode an existing entry is updated in place with the new schema, keys and counts
+def registerDataset(configstr, dataframe, userdatadir, tablename, originalpath, description, details, options=None):
+
+    if(options is None):
+        options = {}
+    identifier, filename, tablepath = dataset_location(userdatadir, tablename, originalpath)
+
+    created = datetime.now()
+    user = getpass.getuser()
+
     schema = str(dataframe.dtypes)
     params = defaultdict(str)
     params['name'] = filename
@@ -50,19 +90,119 @@ def saveDataset(configstr, dataframe, userdatadir, tablename, originalpath, desc
 
     params['filepath'] = tablepath
     params['schema'] = schema
+    params['hdf5_keys'] = json.dumps(options['hdf5_keys']) if 'hdf5_keys' in options else None
+    params['row_count'] = options.get('row_count')
+    params['partition_scheme'] = json.dumps(options['partition_by']) if 'partition_by' in options else None
+    params['write_profile'] = json.dumps(options['profile']) if options.get('profile') else None
+    params['module_parameters'] = json.dumps(options['module_parameters']) if 'module_parameters' in options else ''
 
-    try:
-        dataframe.write.parquet(tablepath)
-    except Exception as e:
-        raise RuntimeError(e)
+    with metadata_lock:
+        sessionconfig = config_session(configstr)
+        if(options.get('append') and get_dataset(sessionconfig, filename)):
+            update_dataset(sessionconfig, params)
+        else:
+            create_dataset(sessionconfig, params)
+            if(options.get('parents')):  # Derived datasets like the count rollups are linked to the tables they summarize
+                create_relation(sessionconfig, filename, options['parents'])
+
+
+# Returns the HDF5 date groups which the dataset already holds, its partition columns
+# (None when the dataset does not exist yet) and its write profile
+def imported_layout(configstr, name):
+
+    dataset = get_dataset(config_session(configstr), name)
+    if(dataset is None):
+        return ([], None, None)
+    if(dataset.hdf5_keys is None):
+        raise RuntimeError("The dataset " + name + " has no record of its HDF5 keys, it has to be imported again before appending")
+
+    partition_by = []  # Datasets written before partitioning was introduced are flat
+    if(dataset.partition_scheme):
+        partition_by = json.loads(dataset.partition_scheme)
+
+    profile = None
+    if(dataset.write_profile):
+        profile = json.loads(dataset.write_profile)
+
+    return (json.loads(dataset.hdf5_keys), partition_by, profile)
+
+
+# Granularity in milliseconds of an existing count rollup dataset, None when there is no such dataset
+def rollup_granularity(configstr, name):
+
+    dataset = get_dataset(config_session(configstr), name)
+    if(dataset is None or not dataset.module_parameters):
+        return None
+    return json.loads(dataset.module_parameters)['granularity']
+
+
+# Finds the count rollup derived from the dataset stored at filepath, returns its filepath and granularity or None
+def find_rollup(configstr, filepath):
+
+    session = config_session(configstr)[0]
+    dataset = session.query(Dataset).filter_by(filepath=filepath).first()
+    if(dataset is None):
+        return None
+
+    for derived in dataset.derived:
+        if(derived.name == dataset.name + '_ROLLUP' and derived.module_parameters):
+            return (derived.filepath, json.loads(derived.module_parameters)['granularity'])
+    return None
+
+
+# Total size in bytes of the files under a path of any Hadoop supported file system
+def path_size(sc, path):
+
+    jpath = sc._jvm.org.apache.hadoop.fs.Path(path)
+    filesystem = jpath.getFileSystem(sc._jsc.hadoopConfiguration())
+    return filesystem.getContentSummary(jpath).getLength()
+
+
+ANALYSIS_MODULES = ['depth', 'tables']  # The helpers which the tasks of the analysis modules call, shipped as sparkles.modules.utils
 
-    sessionconfig = config_session(configstr)
-    create_dataset(sessionconfig, params)
 
+# Ships helper modules which the tasks of a module call to the executors. Spark sends the functions of an importable
+# module as references, so the executors import them by the same name as the driver: the modules are zipped in the
+# package they are imported from (utils or sparkles.modules.utils) with empty package files, which keeps the rest of
+# the helpers and their dependencies (the metadata, Swift and HDFS clients) off the executors
+def ship_modules(sc, helperpath, package, modulenames):
 
-def saveFeatures(dataframe, features, module_parameters, inputs):
+    zippath = os.path.join(tempfile.mkdtemp(), package.replace('.', '_') + '.zip')
+    packagedir = package.replace('.', '/')
+    with zipfile.ZipFile(zippath, 'w') as archive:
+        parts = package.split('.')
+        for i in range(1, len(parts) + 1):
+            archive.writestr('/'.join(parts[:i]) + '/__init__.py', '')
+        for modulename in modulenames:
+            archive.write(os.path.join(helperpath, 'utils', modulename + '.py'), packagedir + '/' + modulename + '.py')
 
-    if 'module_testing' not in features:  # Do not proceed if we are just testing a module
+    sc.addPyFile(zippath)
+    return zippath
+
+
+# Sets up the Hadoop configuration of a Spark context for the backend, the same settings as the main of the modules
+def configure_backend(sc, backend):
+
+    if(backend == 'swift'):
+        hadoopConf = sc._jsc.hadoopConfiguration()
+        hadoopConf.set("fs.swift.impl", "org.apache.hadoop.fs.swift.snative.SwiftNativeFileSystem")
+        hadoopConf.set("fs.swift.service.SparkTest.auth.url", os.environ['OS_AUTH_URL'] + "/tokens")
+        hadoopConf.set("fs.swift.service.SparkTest.http.port", "8443")
+        hadoopConf.set("fs.swift.service.SparkTest.auth.endpoint.prefix", "/")
+        hadoopConf.set("fs.swift.service.SparkTest.region", os.environ['OS_REGION_NAME'])
+        hadoopConf.set("fs.swift.service.SparkTest.public", "false")
+        hadoopConf.set("fs.swift.service.SparkTest.tenant", os.environ['OS_TENANT_ID'])
+        hadoopConf.set("fs.swift.service.SparkTest.username", os.environ['OS_USERNAME'])
+        hadoopConf.set("fs.swift.service.SparkTest.password", os.environ['OS_PASSWORD'])
+
+
+# Writes the module result as a featureset and returns it read back from the written files, so that anything done
+# with the result afterwards (like the preview) does not run the module pipeline again.
+# Without a featureset to save (no features, no featureset_name or when testing) the dataframe is returned as it is
+# partition_by lists the columns of the featureset which are written as partition directories
+def saveFeatures(dataframe, features, module_parameters, inputs, partition_by=None):
+
+    if(features and 'module_testing' not in features and features.get('featureset_name')):
         parent_datasets = []
         for input_item in inputs:
             input_item_filepath = str(input_item)
@@ -97,9 +237,13 @@ def saveFeatures(dataframe, features, module_parameters, inputs):
 
         params['filepath'] = filepath
         params['schema'] = schema
+        params['cache_key'] = features.get('cache_key')  # Set by run_analysis to find the featureset when the run is repeated
 
         try:
-            dataframe.write.parquet(filepath)
+            writer = dataframe.write
+            if(partition_by):
+                writer = writer.partitionBy(*partition_by)
+            writer.parquet(filepath)
         except Exception as e:
             raise RuntimeError(e)
 
@@ -107,6 +251,21 @@ def saveFeatures(dataframe, features, module_parameters, inputs):
         create_featureset(sessionconfig, params)
         create_relation(sessionconfig, featureset_name, parent_datasets)
 
+        return dataframe.sql_ctx.read.parquet(filepath)
+
+    return dataframe
+
+
+# Prints the first rows of a module result, preview_rows in the features sets how many (20 by default)
+def previewFeatures(dataframe, features=None):
+
+    rows = PREVIEW_ROWS
+    if(features and 'preview_rows' in features):
+        rows = int(features['preview_rows'])
+
+    for row in dataframe.take(rows):
+        print(row)
+
 
 def config_session(configstr):
 
@@ -191,36 +350,71 @@ def saveObjsBackend(objs, backend, config):
     print('Metadata/Module changed and uploaded')
 
 
+def get_dataset(sessionconfig, name):
+
+    session = sessionconfig[0]
+    return session.query(Dataset).from_statement(text("SELECT * FROM datasets where name=:name")).\
+        params(name=name).first()
+
+
+def upload_metadata(config):
+
+    objs = []
+    if(config['BACKEND'] == 'hdfs'):
+        objs.append((config['MODULES_DIR'] + 'sqlite.db', config['METADATA_LOCAL_PATH']))
+    elif(config['BACKEND'] == 'swift'):
+        objs.append(('sqlite.db', config['METADATA_LOCAL_PATH']))
+    elif(config['BACKEND'] == 'nfs'):
+        pass
+
+    saveObjsBackend(objs, config['BACKEND'], config)
+
+
 def create_dataset(sessionconfig, params):
 
     session = sessionconfig[0]
     config = sessionconfig[1]
 
-    checkDataset = session.query(Dataset).from_statement(text("SELECT * FROM datasets where name=:name")).\
-        params(name=params['name']).first()
+    checkDataset = get_dataset(sessionconfig, params['name'])
 
     if(checkDataset is None):
 
-        dataset = Dataset(name=params['name'], identifier=params['identifier'], description=params['description'], details=params['details'], module_parameters='', created=params['created'], user=params['user'], fileformat="Parquet", filepath=params['filepath'], schema=params['schema'], module_id='')
+        dataset = Dataset(name=params['name'], identifier=params['identifier'], description=params['description'], details=params['details'], module_parameters=params['module_parameters'], created=params['created'], user=params['user'], fileformat="Parquet", filepath=params['filepath'], schema=params['schema'], module_id='', hdf5_keys=params['hdf5_keys'], row_count=params['row_count'], partition_scheme=params['partition_scheme'], write_profile=params['write_profile'])
         shutil.copyfile(config['METADATA_LOCAL_PATH'], config['BACKUP_METADATA_LOCAL_PATH'])
 
         session.add(dataset)
         session.commit()
 
-        objs = []
-        if(config['BACKEND'] == 'hdfs'):
-            objs.append((config['MODULES_DIR'] + 'sqlite.db', config['METADATA_LOCAL_PATH']))
-        elif(config['BACKEND'] == 'swift'):
-            objs.append(('sqlite.db', config['METADATA_LOCAL_PATH']))
-        elif(config['BACKEND'] == 'nfs'):
-            pass
-
-        saveObjsBackend(objs, config['BACKEND'], config)
+        upload_metadata(config)
 
     else:
         raise RuntimeError("The dataset with name " + params['name'] + " already exists")
 
 
+def update_dataset(sessionconfig, params):
+
+    session = sessionconfig[0]
+    config = sessionconfig[1]
+
+    dataset = get_dataset(sessionconfig, params['name'])
+
+    if(dataset):
+        shutil.copyfile(config['METADATA_LOCAL_PATH'], config['BACKUP_METADATA_LOCAL_PATH'])
+
+        dataset.filepath = params['filepath']
+        dataset.schema = params['schema']
+        dataset.hdf5_keys = params['hdf5_keys']
+        dataset.row_count = params['row_count']
+        dataset.partition_scheme = params['partition_scheme']
+        dataset.write_profile = params['write_profile']
+        session.commit()
+
+        upload_metadata(config)
+
+    else:
+        raise RuntimeError("The dataset with name " + params['name'] + " does not exist")
+
+
 def create_featureset(sessionconfig, params):
 
     session = sessionconfig[0]
@@ -237,7 +431,7 @@ def create_featureset(sessionconfig, params):
             params(name=params['name']).first()
 
         if(checkDataset is None):
-            dataset = Dataset(name=params['name'], identifier='', description=params['description'], details=params['details'], module_parameters=params['module_parameters'], created=params['created'], user=params['user'], fileformat="Parquet", filepath=params['filepath'], schema=params['schema'], module_id=analysisMod.id)
+            dataset = Dataset(name=params['name'], identifier='', description=params['description'], details=params['details'], module_parameters=params['module_parameters'], created=params['created'], user=params['user'], fileformat="Parquet", filepath=params['filepath'], schema=params['schema'], module_id=analysisMod.id, cache_key=params['cache_key'] or None)
             shutil.copyfile(config['METADATA_LOCAL_PATH'], config['BACKUP_METADATA_LOCAL_PATH'])
 
             session.add(dataset)
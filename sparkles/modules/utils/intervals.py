@@ -0,0 +1,37 @@
+import os
+
+
+# Imported datasets are named <identifier>_<TABLE>
+def table_name(filepath):
+
+    name = os.path.splitext(os.path.basename(filepath.rstrip('/')))[0]
+    return name.split('_')[-1].upper()
+
+
+# The rollup can answer when the window and all the intervals are aligned to its granularity
+def rollup_fits(rollup, intervals, start_time, end_time):
+
+    if(rollup is None):
+        return False
+    granularity = rollup[1]
+    return start_time % granularity == 0 and end_time % granularity == 0 and all(interval % granularity == 0 for interval in intervals)
+
+
+# The intervals are sorted from the finest, which every coarser one has to be a multiple of
+def parse_intervals(interval):
+
+    intervals = interval if isinstance(interval, list) else [interval]
+    intervals = sorted(set(float(i) for i in intervals))
+    for coarser in intervals[1:]:
+        if(coarser % intervals[0] != 0):
+            raise RuntimeError("Interval " + str(coarser) + " is not a multiple of the finest interval " + str(intervals[0]))
+    return intervals
+
+
+# The columns of the count featureset. A single interval on a single input keeps the featureset a single interval count
+# has always produced, otherwise every row tells its table and interval
+def count_columns(intervals, inputs):
+
+    if(len(intervals) == 1 and len(inputs) == 1):
+        return ['timestamp', 'count']
+    return ['table', 'interval', 'timestamp', 'count']
@@ -1,16 +1,38 @@
 import uuid
+import threading
 
-from sqlalchemy import create_engine, Table, Column, String, Text, DateTime, ForeignKey
+from sqlalchemy import create_engine, inspect, Table, Column, String, Text, DateTime, ForeignKey, BigInteger
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 
 Base = declarative_base()
 
+engines = {}  # One engine per metadata URI, the tables are created and upgraded when the engine is created
+engines_lock = threading.Lock()
+
 
 def config_to_db_session(config_dbpath, Base):
-    engine = create_engine(config_dbpath)
-    Base.metadata.create_all(engine)
-    return sessionmaker(bind=engine)()
+    with engines_lock:
+        if(config_dbpath not in engines):
+            engine = create_engine(config_dbpath)
+            Base.metadata.create_all(engine)
+            add_missing_columns(engine, Base)
+            engines[config_dbpath] = engine
+    return sessionmaker(bind=engines[config_dbpath])()
+
+
+# create_all does not alter existing tables, so the columns added after a metadata file was created are added here
+# together with their indexes
+def add_missing_columns(engine, Base):
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        existing = [column['name'] for column in inspector.get_columns(table.name)]
+        for column in table.columns:
+            if(column.name not in existing):
+                engine.execute('ALTER TABLE ' + table.name + ' ADD COLUMN ' + column.name + ' ' + column.type.compile(engine.dialect))
+                for index in table.indexes:
+                    if(column.name in index.columns):
+                        index.create(engine)
 
 
 class Analysis(Base):
@@ -26,11 +48,12 @@ class Analysis(Base):
     parameters = Column(Text())
     inputs = Column(Text())
     outputs = Column(Text())
+    checksum = Column(String(64))  # SHA-256 of the module file, the local copies with the same hash are not downloaded again
 
     def __init__(self):
         pass
 
-    def __init__(self, name, filepath, description, details, created, user, parameters, inputs, outputs):
+    def __init__(self, name, filepath, description, details, created, user, parameters, inputs, outputs, checksum=None):
         self.id = uuid.uuid4().hex
         self.name = name
         self.filepath = filepath
@@ -41,6 +64,7 @@ class Analysis(Base):
         self.parameters = parameters
         self.inputs = inputs
         self.outputs = outputs
+        self.checksum = checksum
 
 
 fs_to_ds = Table("fs_to_ds", Base.metadata, Column("left_fs_id", String, ForeignKey("datasets.id"), primary_key=True), Column("right_ds_id", String, ForeignKey("datasets.id"), primary_key=True))
@@ -62,10 +86,15 @@ class Dataset(Base):
     module = relationship('Analysis')
     module_parameters = Column(Text())
     schema = Column(Text())
+    hdf5_keys = Column(Text())  # JSON list of the HDF5 date groups already imported to the dataset
+    row_count = Column(BigInteger())
+    partition_scheme = Column(Text())  # JSON list of the Parquet partition columns, e.g. ["day", "ob_id"]
+    write_profile = Column(Text())  # JSON of the Parquet codec, encodings and column types used by the import
+    cache_key = Column(String(64), index=True)  # Key of the module, parameters and inputs of the run which made a featureset
 
     parents = relationship("Dataset", secondary="fs_to_ds", primaryjoin="Dataset.id==fs_to_ds.c.left_fs_id", secondaryjoin="Dataset.id==fs_to_ds.c.right_ds_id", backref="derived")
 
-    def __init__(self, name, fileformat, identifier, description, details, filepath, user, created, module_id, module_parameters, schema):
+    def __init__(self, name, fileformat, identifier, description, details, filepath, user, created, module_id, module_parameters, schema, hdf5_keys=None, row_count=None, partition_scheme=None, write_profile=None, cache_key=None):
         self.id = uuid.uuid4().hex
         self.name = name
         self.fileformat = fileformat
@@ -78,3 +107,8 @@ class Dataset(Base):
         self.module_parameters = module_parameters
         self.schema = schema
         self.module_id = module_id
+        self.hdf5_keys = hdf5_keys
+        self.row_count = row_count
+        self.partition_scheme = partition_scheme
+        self.write_profile = write_profile
+        self.cache_key = cache_key
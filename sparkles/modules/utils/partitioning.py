@@ -0,0 +1,20 @@
+import heapq
+
+
+def pack_keys(sizes, partitions):
+
+    ''' Distributes the keys over at most the given number of bins so that every bin gets about the same total size.
+    sizes is a list of (key, size) pairs. The largest remaining key always goes to the lightest bin (LPT bin packing).
+    The bins are returned heaviest first so that the longest tasks are scheduled first.
+    '''
+
+    bins = [(0, index, []) for index in range(min(max(partitions, 1), len(sizes)))]
+    heapq.heapify(bins)
+
+    for key, size in sorted(sizes, key=lambda x: x[1], reverse=True):
+        load, index, keys = heapq.heappop(bins)
+        keys.append(key)
+        heapq.heappush(bins, (load + size, index, keys))
+
+    bins.sort(key=lambda x: x[0], reverse=True)
+    return [keys for load, index, keys in bins]
@@ -2,8 +2,9 @@ from sqlalchemy import text
 from models import Base, config_to_db_session, Dataset, Analysis
 from datetime import datetime
 import getpass
-from helper import saveObjsBackend, getObjsBackend, delete_item
-from subprocess import call
+from helper import saveObjsBackend, getObjsBackend, delete_item, configure_backend, upload_metadata, ship_modules, ANALYSIS_MODULES
+from checksum import file_checksum, cache_key
+from subprocess import call, Popen, PIPE, STDOUT
 import yaml
 import os
 from os.path import dirname
@@ -13,9 +14,87 @@ import warnings
 import shutil
 import socket
 import re
+import imp
+import time
+import uuid
+import threading
 from urlparse import urlparse
 
 
+class AnalysisJob(object):
+
+    ''' Handle of an analysis submitted with SparkRunner.submit_analysis. The job waits for a free slot of the runner
+    and runs pyspark in a background thread, keeping its output. status is 'queued', 'running', 'succeeded' or 'failed'
+    A job which reuses an existing featureset (reused is its name) has nothing to run and has succeeded at once
+    '''
+
+    def __init__(self, name, command, slots, reused=None):
+
+        self.name = name
+        self.command = command
+        self.status = 'queued'
+        self.exit_code = None
+        self.started = None
+        self.finished = None
+        self.output = []  # Lines of the stdout and stderr of pyspark
+        self.finished_event = threading.Event()
+
+        if(reused is not None):
+            self.output.append(('Reusing the featureset ' + reused + ' made with the same module, params and inputs').encode())
+            self.started = self.finished = time.time()
+            self.exit_code = 0
+            self.status = 'succeeded'
+            self.thread = None
+            self.finished_event.set()
+            return
+
+        self.thread = threading.Thread(target=self.run, args=(slots,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self, slots):
+
+        with slots:
+            self.started = time.time()
+            self.status = 'running'
+            try:
+                process = Popen(self.command, stdout=PIPE, stderr=STDOUT)
+                for line in iter(process.stdout.readline, b''):
+                    self.output.append(line)
+                process.stdout.close()
+                self.exit_code = process.wait()
+            except OSError as e:  # pyspark could not be started
+                self.output.append(str(e).encode())
+                self.exit_code = -1
+            finally:
+                self.finished = time.time()
+                self.status = 'succeeded' if self.exit_code == 0 else 'failed'
+                self.finished_event.set()
+
+    def done(self):
+
+        return self.finished_event.is_set()
+
+    def wait(self, timeout=None):
+
+        ''' Waits until the job has finished (or the timeout in seconds has passed) and returns the exit code '''
+
+        self.finished_event.wait(timeout)
+        return self.exit_code
+
+    def logs(self):
+
+        return b''.join(self.output)
+
+    def elapsed(self):
+
+        ''' Seconds the job has been running, None while it is queued '''
+
+        if(self.started is None):
+            return None
+        return (self.finished or time.time()) - self.started
+
+
 class SparkRunner(object):
 
     def __init__(self, configpath=None):
@@ -48,6 +127,117 @@ class SparkRunner(object):
         self.backup_metadata_path = config['BACKUP_METADATA_LOCAL_PATH']
         self.hadoop_port = config['HADOOP_RPC_PORT']
 
+        self.job_slots = threading.BoundedSemaphore(int(config.get('MAX_CONCURRENT_JOBS', 4)))  # Analyses submitted at once
+
+        self.sc = None  # Spark context and SQL context of the session started with start_session
+        self.sqlContext = None
+        self.cached_datasets = {}
+
+    def start_session(self, master=None, app_name='Sparkles session'):
+
+        ''' Starts one Spark application in this process which the following run_analysis and test_analysis calls run in,
+        instead of launching pyspark for every run. The executors stay up between the runs and the datasets cached with
+        cache_dataset are read from memory by the modules. master is CLUSTER_URL of the config by default ('local[*]' to test)
+        pyspark has to be importable (SPARK_HOME/python and py4j on the PYTHONPATH)
+        '''
+
+        if(self.sc is not None):
+            raise RuntimeError("A session is already running, stop it first")
+
+        try:
+            from pyspark import SparkConf, SparkContext
+            from pyspark.sql import SQLContext
+        except ImportError:
+            raise RuntimeError("pyspark is needed to start a session")
+
+        conf = SparkConf()
+        conf.setMaster(master or self.clusterUrl)
+        conf.setAppName(app_name)
+        conf.set("spark.jars", "file:/shared_data/spark_jars/hadoop-openstack-3.0.0-SNAPSHOT.jar")
+        self.sc = SparkContext(conf=conf)
+        configure_backend(self.sc, self.backend)
+
+        helperpath = dirname(dirname(os.path.abspath(__file__)))
+        self.sc.addFile(helperpath + "/utils/helper.py")  # For the modules which import it on the executors
+        ship_modules(self.sc, helperpath, 'sparkles.modules.utils', ANALYSIS_MODULES)  # The module mains are not run in a session
+
+        self.sqlContext = SQLContext(self.sc)
+        self.sqlContext.setConf("spark.sql.shuffle.partitions", str(self.config['SHUFFLE_PARTITIONS']))
+
+    def stop_session(self):
+
+        ''' Releases the cached datasets and stops the Spark application of the session '''
+
+        if(self.sc is None):
+            raise RuntimeError("No session is running")
+
+        for dataframe in self.cached_datasets.values():
+            dataframe.unpersist()
+        self.cached_datasets = {}
+        self.sc.stop()
+        self.sc = None
+        self.sqlContext = None
+
+    def cache_dataset(self, datasetname=''):
+
+        ''' Keeps a dataset in the memory of the session executors. The modules read their inputs from the same Parquet
+        path, which Spark matches with the cached data, so the following runs on the dataset do not read it again
+        '''
+
+        if(self.sc is None):
+            raise RuntimeError("Start a session before caching datasets")
+
+        if(datasetname not in self.cached_datasets):
+            dataset = self.session.query(Dataset).filter_by(name=datasetname).first()
+            if(dataset is None):
+                raise RuntimeError("Dataset " + datasetname + " not found")
+            dataframe = self.sqlContext.read.parquet(str(dataset.filepath))
+            dataframe.cache()
+            dataframe.count()  # Loads the cache now rather than in the first run
+            self.cached_datasets[datasetname] = dataframe
+
+        return self.cached_datasets[datasetname]
+
+    def run_in_session(self, modulepath, params, filepaths, features):
+
+        ''' Loads the module file and calls its module_implementation with the Spark contexts of the session '''
+
+        modulename = 'sparkles_analysis_' + re.sub(r'\W', '_', os.path.splitext(os.path.basename(modulepath))[0])
+        module = imp.load_source(modulename, modulepath)  # Loaded again for every run so that a changed module is used
+        if(not hasattr(module, 'module_implementation')):
+            raise RuntimeError("Module " + modulepath + " has no module_implementation")
+
+        # The same values as the main of the module gets from the command line
+        params = json.loads(json.dumps(params))
+        features = json.loads(json.dumps(features)) if features else {}
+        return module.module_implementation(self.sc, self.sqlContext, params=params, inputs=filepaths, features=features)
+
+    def featureset_defaults(self, features, modulename):
+
+        ''' Adds the default userdatadir of the backend, the configstr and the module name to the features of a run '''
+
+        if('userdatadir' not in features):
+            if(self.backend == 'hdfs'):
+                features['userdatadir'] = 'hdfs://' + socket.gethostname() + ':' + str(self.hadoop_port) + self.config['FEATURES_DIR']
+            elif(self.backend == 'swift'):
+                features['userdatadir'] = 'swift://containerFeatures.SparkTest'
+            elif(self.backend == 'nfs'):
+                features['userdatadir'] = 'file://' + self.config['FEATURES_DIR']
+
+        features['configstr'] = self.configstr  # The configstr is passed as a default parameter
+        features['modulename'] = modulename
+        return features
+
+    def module_features(self, features, modulename):
+
+        ''' The features passed to a module. The configstr is there also in the runs without a featureset to save,
+        so that every run of a module can read the metadata (the event count finds the rollups of the import with it)
+        '''
+
+        if(features is None):
+            return {'configstr': self.configstr}
+        return self.featureset_defaults(features, modulename)
+
     def list_modules(self, prefix=''):
 
         ''' Searches for the modules according to the given prefix.
@@ -91,7 +281,7 @@ class SparkRunner(object):
             params(name=name).first()
 
         if(checkMod is None):
-            analysisMod = Analysis(name=name, filepath=filename, description=description, details=details, created=created, user=user, parameters=params, inputs=inputs, outputs=outputs)
+            analysisMod = Analysis(name=name, filepath=filename, description=description, details=details, created=created, user=user, parameters=params, inputs=inputs, outputs=outputs, checksum=file_checksum(filepath))
             shutil.copyfile(self.config['METADATA_LOCAL_PATH'], self.backup_metadata_path)  # Backup metadata
 
             self.session.add(analysisMod)
@@ -111,75 +301,223 @@ class SparkRunner(object):
         else:
             raise RuntimeError("Analysis " + name + " already exists")
 
-    def run_analysis(self, modulename='', params=None, inputs=None, features=None):
+    def run_analysis(self, modulename='', params=None, inputs=None, features=None, force=False):
 
         ''' Runs the given analysis module against the given input datasets and produces the output.
         The analysis module and the datasets have to be imported first (Metadata is read)
         The output can be printed on console or saved as a featureset (features parameter needs to be specified)
+        Returns the exit code of pyspark, or while a session is running (start_session) the module runs in it and
+        its result dataframe is returned
+        A featureset made earlier by the same module file with the same params and input datasets is reused instead of
+        running the module again: the name of the reused featureset is returned instead of the exit code (no featureset
+        of the requested name is made), in a session the featureset itself. force=True runs the module anyway
         '''
 
         if(modulename is None or params is None or inputs is None):
             raise RuntimeError("Modulename, params and inputs are necessary")
         else:
-            analysisMod = self.session.query(Analysis).from_statement(text("SELECT * FROM analysis where name=:name")).\
-                params(name=modulename).first()
-            if(analysisMod):
-                filepaths = ''
-                filepathsarr = []
+            out_file = self.fetch_analysis(modulename)
+            filepathsarr = self.dataset_paths(inputs)
 
-                # Download the module from Storage first
-                out_file = self.config['MODULES_DIR_LOCAL'] + analysisMod.filepath
+            cached = self.reusable_featureset(out_file, params, inputs, features, force)
+            if(cached is not None):
+                if(self.sc is not None):
+                    return self.sqlContext.read.parquet(str(cached.filepath))
+                return cached.name
 
-                objs = []
+            if(self.sc is not None):
+                return self.run_in_session(out_file, params, filepathsarr, self.module_features(features, modulename))
 
-                if(self.config['BACKEND'] == 'hdfs'):
-                    objs.append((self.hdfsmodpath + analysisMod.filepath, out_file))
-                elif(self.config['BACKEND'] == 'swift'):
-                    objs.append((analysisMod.filepath, out_file))
-                elif(self.config['BACKEND'] == 'nfs'):
-                    pass
+            return call(self.analysis_command(modulename, out_file, params, filepathsarr, features))
 
-                getObjsBackend(objs, self.backend, self.config)  # Act acciording to the backend choice
+    def submit_analysis(self, modulename='', params=None, inputs=None, features=None, force=False):
 
-                for inputfile in inputs:
-                    dataset = self.session.query(Dataset).from_statement(text("SELECT * FROM datasets where name=:name")).\
-                        params(name=inputfile).first()
-                    if(dataset):
-                        filepathsarr.append(dataset.filepath)
+        ''' Starts the given analysis like run_analysis without waiting for it and returns its AnalysisJob.
+        At most MAX_CONCURRENT_JOBS of the config (default 4) submitted analyses run at once, the others wait in the queue
+        An existing featureset of the same run is reused as in run_analysis, the job has then succeeded at once
+        '''
 
-                if(not filepathsarr):
-                    raise RuntimeError("No datasets found")
+        if(modulename is None or params is None or inputs is None):
+            raise RuntimeError("Modulename, params and inputs are necessary")
 
-                filepaths = json.dumps(filepathsarr)
-                params = json.dumps(params)
+        out_file = self.fetch_analysis(modulename)
+        filepathsarr = self.dataset_paths(inputs)
+        cached = self.reusable_featureset(out_file, params, inputs, features, force)
+        if(cached is not None):
+            return AnalysisJob(modulename, None, self.job_slots, reused=cached.name)
+        return AnalysisJob(modulename, self.analysis_command(modulename, out_file, params, filepathsarr, features), self.job_slots)
 
-                helperpath = dirname(dirname(os.path.abspath(__file__)))
+    def analysis_cache_key(self, modulepath, params, inputs):
 
-                shuffle_partitions = str(self.config['SHUFFLE_PARTITIONS'])
+        ''' The key of running the module file with the params on the named datasets. The inputs are identified by their
+        metadata id and row count, so that a dataset imported again or appended to gets a new key
+        '''
 
-                if(features is None):
-                    call([self.config['PYSPARK_CLIENT_PATH'], out_file, "--master", self.clusterUrl, self.backend, helperpath, params, filepaths])
-                else:  # When there's a featureset to be saved from the module
-                    if('userdatadir' not in features):
-                        if(self.backend == 'hdfs'):
-                            features['userdatadir'] = 'hdfs://' + socket.gethostname() + ':' + str(self.hadoop_port) + self.config['FEATURES_DIR']
-                        elif(self.backend == 'swift'):
-                            features['userdatadir'] = 'swift://containerFeatures.SparkTest'
-                        elif(self.backend == 'nfs'):
-                            features['userdatadir'] = 'file://' + self.config['FEATURES_DIR']
-
-                    features['configstr'] = self.configstr  # The configstr is passed as a default parameter
-                    features['modulename'] = modulename
-                    features = json.dumps(features)
-                    call([self.config['PYSPARK_CLIENT_PATH'], out_file, "--master", self.clusterUrl, self.backend, helperpath, shuffle_partitions, params, filepaths, features])
+        datasets = []
+        for inputfile in inputs:
+            dataset = self.session.query(Dataset).filter_by(name=inputfile).first()
+            if(dataset):
+                datasets.append([dataset.id, dataset.row_count])
+        return cache_key(file_checksum(modulepath), params, datasets)
 
-            else:
-                raise RuntimeError("Analysis module not found")
+    def reusable_featureset(self, modulepath, params, inputs, features, force=False):
+
+        ''' Stamps the cache key of a run on its features, so that the featureset it saves can be reused by the later
+        runs, and returns the featureset saved earlier with the same key. None when the run saves no featureset,
+        there is no such featureset or the run is forced
+        '''
+
+        if(features is None):
+            return None
+        features['cache_key'] = self.analysis_cache_key(modulepath, params, inputs)
+        cached = None if force else self.cached_featureset(features['cache_key'])
+        if(cached is not None):
+            print('Reusing the featureset ' + cached.name + ' made with the same module, params and inputs')
+        return cached
+
+    def cached_featureset(self, key):
+
+        ''' The latest featureset saved with the cache key, None when there is none '''
+
+        return self.session.query(Dataset).filter_by(cache_key=key).order_by(Dataset.created.desc()).first()
+
+    def invalidate_cache(self, featureset_name=None, modulename=None):
+
+        ''' Stops reusing the featureset with the given name, or all the featuresets made by the given module,
+        so that the next run_analysis with the same params and inputs runs the module again. The featuresets are kept
+        '''
+
+        if(featureset_name is None and modulename is None):
+            raise RuntimeError("A featureset name or a module name is required")
+
+        query = self.session.query(Dataset).filter(Dataset.cache_key.isnot(None))
+        if(featureset_name is not None):
+            query = query.filter_by(name=featureset_name)
+        if(modulename is not None):
+            query = query.filter(Dataset.module.has(name=modulename))
+
+        invalidated = query.all()
+        if(invalidated):
+            shutil.copyfile(self.config['METADATA_LOCAL_PATH'], self.backup_metadata_path)  # Backup metadata
+            for dataset in invalidated:
+                dataset.cache_key = None
+            self.session.commit()
+            upload_metadata(self.config)  # The other runners read the metadata from the backend
+        return len(invalidated)
+
+    def analysis_command(self, modulename, modulepath, params, filepathsarr, features):
+
+        ''' The pyspark command line which runs a module on the input files '''
+
+        filepaths = json.dumps(filepathsarr)
+        params = json.dumps(params)
+
+        helperpath = dirname(dirname(os.path.abspath(__file__)))
+
+        shuffle_partitions = str(self.config['SHUFFLE_PARTITIONS'])
+
+        features = json.dumps(self.module_features(features, modulename))
+        return [self.config['PYSPARK_CLIENT_PATH'], modulepath, "--master", self.clusterUrl, self.backend, helperpath, shuffle_partitions, params, filepaths, features]
+
+    def run_analysis_batch(self, modulename='', runs=None, inputs=None, force=False):
+
+        ''' Runs the given analysis module several times on the same input datasets in one Spark application, for example
+        to sweep the interval or the time window. runs is a list of (params, features) pairs, features None to only print
+        the result or the features of a featureset as in run_analysis (every run needs its own featureset_name).
+        The inputs are read and cached once for all the runs. Returns the exit code of pyspark, which is not 0 when
+        any of the runs failed, or while a session is running the runs are done in it and the list of their result
+        dataframes is returned. The runs whose featureset exists already are not run again, unless force=True
+        '''
+
+        if(modulename is None or not runs or inputs is None):
+            raise RuntimeError("Modulename, runs and inputs are necessary")
+
+        out_file = self.fetch_analysis(modulename)
+        filepathsarr = self.dataset_paths(inputs)
+        reused = [self.reusable_featureset(out_file, params, inputs, features, force) for params, features in runs]
+        runs = [(params, self.module_features(features, modulename)) for params, features in runs]
+
+        if(self.sc is not None):
+            cached = [name for name in inputs if name not in self.cached_datasets]
+            for name in inputs:
+                self.cache_dataset(name)
+            try:
+                return [self.run_in_session(out_file, params, filepathsarr, features) if featureset is None else self.sqlContext.read.parquet(str(featureset.filepath))
+                        for (params, features), featureset in zip(runs, reused)]
+            finally:
+                for name in cached:  # Only the datasets which were not cached before the batch
+                    self.cached_datasets.pop(name).unpersist()
+
+        runs = [run for run, featureset in zip(runs, reused) if featureset is None]
+        if(not runs):
+            return 0
+
+        path = dirname(dirname(os.path.abspath(__file__)))
+        shuffle_partitions = str(self.config['SHUFFLE_PARTITIONS'])
+        exit_code = call([self.config['PYSPARK_CLIENT_PATH'], path + "/batch_analysis.py", "--master", self.clusterUrl, self.backend, path, shuffle_partitions, out_file, json.dumps(runs), json.dumps(filepathsarr)])
+        if(exit_code != 0):  # The failed runs are listed in the output of the batch
+            print('Batch of ' + modulename + ' failed with exit code ' + str(exit_code))
+        return exit_code
+
+    def fetch_analysis(self, modulename):
+
+        ''' Downloads the module of an imported analysis from the backend and returns its local path.
+        A local copy with the checksum of the module in the metadata is used as it is. The download goes to a temporary
+        file which is checked against the checksum and renamed over the local copy, so runners on the same host never see
+        a partly written module and a failed download is never run
+        '''
+
+        analysisMod = self.session.query(Analysis).from_statement(text("SELECT * FROM analysis where name=:name")).\
+            params(name=modulename).first()
+        if(not analysisMod):
+            raise RuntimeError("Analysis module not found")
+
+        out_file = self.config['MODULES_DIR_LOCAL'] + analysisMod.filepath
+        if(self.config['BACKEND'] == 'nfs'):
+            return out_file  # The modules directory is shared, the module is already there
+
+        if(analysisMod.checksum and os.path.exists(out_file) and file_checksum(out_file) == analysisMod.checksum):
+            return out_file
+
+        # Download the module from Storage first
+        part_file = out_file + '.' + uuid.uuid4().hex + '.part'
+
+        objs = []
+
+        if(self.config['BACKEND'] == 'hdfs'):
+            objs.append((self.hdfsmodpath + analysisMod.filepath, part_file))
+        elif(self.config['BACKEND'] == 'swift'):
+            objs.append((analysisMod.filepath, part_file))
+
+        getObjsBackend(objs, self.backend, self.config)  # Act acciording to the backend choice
+        if(not os.path.exists(part_file)):  # The backend clients report some errors without raising
+            raise RuntimeError("Analysis module " + modulename + " could not be downloaded")
+        if(analysisMod.checksum and file_checksum(part_file) != analysisMod.checksum):
+            os.remove(part_file)
+            raise RuntimeError("The downloaded analysis module " + modulename + " does not match its checksum")
+        os.rename(part_file, out_file)  # Atomic on the same file system
+        return out_file
+
+    def dataset_paths(self, inputs):
+
+        ''' The file paths of the named datasets, the names which are not found are left out '''
+
+        filepathsarr = []
+        for inputfile in inputs:
+            dataset = self.session.query(Dataset).from_statement(text("SELECT * FROM datasets where name=:name")).\
+                params(name=inputfile).first()
+            if(dataset):
+                filepathsarr.append(dataset.filepath)
+
+        if(not filepathsarr):
+            raise RuntimeError("No datasets found")
+        return filepathsarr
 
     def test_analysis(self, modulepath='', params=None, inputs=None, features=None):
 
         ''' Tests the given analysis module against the given input datasets and produces the output.
             It is recommended to run this on local mode with small sized input
+            While a session is running the module runs in it (a session started with master 'local[*]' for local mode)
         '''
 
         if(modulepath is None or params is None or inputs is None):
@@ -197,6 +535,14 @@ class SparkRunner(object):
                 if(not filepathsarr):
                     raise RuntimeError("No datasets found")
 
+                if not features:
+                    features = {}
+                features['module_testing'] = True  # Introduce a parameter to keep the system informed that we are testing the module
+                features['configstr'] = self.configstr
+
+                if(self.sc is not None):
+                    return self.run_in_session(modulepath, params, filepathsarr, features)
+
                 filepaths = json.dumps(filepathsarr)
                 params = json.dumps(params)
 
@@ -204,16 +550,25 @@ class SparkRunner(object):
 
                 shuffle_partitions = str(self.config['SHUFFLE_PARTITIONS'])
 
-                if not features:
-                    features = {}
-                features['module_testing'] = True  # Introduce a parameter to keep the system informed that we are testing the module
                 features = json.dumps(features)
                 call([self.config['PYSPARK_CLIENT_PATH'], modulepath, "--master", "local[*]", self.backend, helperpath, shuffle_partitions, params, filepaths, features])
 
-    def import_dataset(self, inputfiles=[], description='', details='', userdatadir=''):
+    def import_dataset(self, inputfiles=[], description='', details='', userdatadir='', mode='spark', chunk_size=None, concurrency=None, append=False, partition_by=None, cluster_by=None, row_group_size=None, profile=None, rollup=None):
 
         ''' Imports a given dataset (on a local path) to the backend which is a Swift object store
         Multiple files can be imported as inputfiles parameters is an array. The userdatadir is the object store container URI
+        The mode 'arrow' writes the Parquet files straight from the HDF5 arrays (needs pyarrow, 0.16 is the last release for Python 2, and an hdfs or nfs backend, write profiles with delta need the spark mode)
+        chunk_size is the number of rows read from the HDF5 tables at a time (IMPORT_CHUNK_SIZE in the config by default)
+        The files are imported as concurrent Spark jobs, at most concurrency (IMPORT_CONCURRENCY, default 4) at a time
+        With append=True only the HDF5 date groups which are missing from existing datasets are imported and added to them
+        partition_by lists the Parquet partition columns, 'day' (UTC day number of the event time) and/or 'ob_id'.
+        The default is IMPORT_PARTITION_BY in the config or ['day'], an empty list writes flat files
+        cluster_by sorts the written rows by 'time' (default), 'ob_id' and time, or 'none' so that the Parquet row group
+        statistics let range predicates skip row groups. row_group_size is the Parquet row group size in bytes
+        profile is the name of a write profile in IMPORT_PROFILES of the config or a dict with the keys codec,
+        dictionary (bool, or columns in the arrow mode), delta (delta encode the timestamps, spark mode only) and types (column to byte/short/int/long)
+        rollup is a granularity in milliseconds (IMPORT_ROLLUP in the config), when given the event counts per ob_id and
+        granularity bucket are stored as <name>_<TABLE>_ROLLUP datasets which the event count module answers from
         '''
 
         if(inputfiles):
@@ -231,7 +586,26 @@ class SparkRunner(object):
             originalpaths = json.dumps(inputfiles)
             partitions = str(self.config['IMPORT_PARTITIONS'])
 
-            call([self.config['PYSPARK_CLIENT_PATH'], path + "/data_import.py", "--master", self.clusterUrl, self.backend, originalpaths, description, details, userdatadir, configstr, partitions])
+            if(mode == 'arrow' and self.backend == 'swift'):
+                raise RuntimeError("The arrow import mode is not supported with the swift backend")
+            options = {'mode': mode, 'append': append}
+            if(chunk_size):
+                options['chunk_size'] = chunk_size
+            if(concurrency):
+                options['concurrency'] = concurrency
+            if(partition_by is not None):
+                options['partition_by'] = partition_by
+            if(cluster_by):
+                options['cluster_by'] = cluster_by
+            if(row_group_size):
+                options['row_group_size'] = row_group_size
+            if(profile):
+                options['profile'] = profile
+            if(rollup):
+                options['rollup'] = rollup
+            options = json.dumps(options)
+
+            call([self.config['PYSPARK_CLIENT_PATH'], path + "/data_import.py", "--master", self.clusterUrl, self.backend, originalpaths, description, details, userdatadir, configstr, partitions, options])
 
         else:
             raise RuntimeError("Please ensure inputfiles is not None or empty")
@@ -0,0 +1,256 @@
+import numpy as np
+from urlparse import urlparse
+import h5py
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None  # Only needed for the arrow import mode
+
+TABLES = ['ORDERS', 'CANCELS', 'TRADES']
+
+# Columns of the HDF5 tables in their stored order, the fields in LONG_FIELDS are epoch milliseconds
+SCHEMA_STRINGS = {
+    'ORDERS': "id ref ob_id created destroyed side price quantity is_round past_id new_id p_id",
+    'CANCELS': "id past_id new_id ob_id timestamp side price quantity",
+    'TRADES': "id ref o_id ob_id timestamp side quantity price p_id cp_id"
+}
+LONG_FIELDS = {'ORDERS': ['created', 'destroyed'], 'CANCELS': ['timestamp'], 'TRADES': ['timestamp']}
+TIME_FIELDS = {'ORDERS': 'created', 'CANCELS': 'timestamp', 'TRADES': 'timestamp'}  # The event time of every table
+
+DAY_MS = 86400000  # The day partition column is the UTC day number of the event time
+
+CHUNK_SIZE = 100000  # Rows read from the HDF5 file at a time unless IMPORT_CHUNK_SIZE or chunk_size is given
+
+# Column types a write profile can choose from, as arrow types and their width in bytes
+ARROW_TYPES = {'byte': 'int8', 'short': 'int16', 'int': 'int32', 'long': 'int64'}
+TYPE_WIDTHS = {'byte': 1, 'short': 2, 'int': 4, 'long': 8}
+
+
+# Yields the dataset in hyperslabs of at most chunk_size rows, so only one chunk is in memory at a time
+def iter_hdf5_chunks(data, chunk_size):
+
+    for start in xrange(0, data.shape[0], chunk_size):
+        yield data[start:start + chunk_size]
+
+
+# The type of a column, narrower types given in the write profile replace the default int/long
+def column_type(table, field_name, profile=None):
+
+    if(profile and field_name in profile.get('types', {})):
+        return profile['types'][field_name]
+    if(field_name in LONG_FIELDS[table]):
+        return 'long'
+    return 'int'
+
+
+# The arrow counterpart of table_schema
+def arrow_schema(table, profile=None):
+
+    fields = []
+    for field_name in SCHEMA_STRINGS[table].split():
+        fields.append(pa.field(field_name, pa.type_for_alias(ARROW_TYPES[column_type(table, field_name, profile)])))
+
+    return pa.schema(fields)
+
+
+# The columns which the rows of a table are sorted by before writing, so that the Parquet row group statistics
+# of the time column (and of ob_id when clustering by it) do not overlap and predicates can skip row groups
+def sort_columns(table, options):
+
+    cluster_by = options.get('cluster_by', 'time')
+    if(cluster_by == 'none'):
+        return []
+
+    columns = list(options.get('partition_by', []))  # Keeps the rows of one partition directory together
+    if(cluster_by == 'ob_id' and 'ob_id' not in columns):
+        columns.append('ob_id')
+    columns.append(TIME_FIELDS[table])
+
+    return columns
+
+
+# Uncompressed size of one row in bytes
+def row_width(table, profile=None):
+
+    return sum(TYPE_WIDTHS[column_type(table, field_name, profile)] for field_name in SCHEMA_STRINGS[table].split())
+
+
+def profile_of(options):
+
+    if(options and options.get('profile')):
+        return options['profile']
+    return {}
+
+
+# Name of a schema field in the HDF5 table, the HDF5 columns are in the same order as the schema
+def hdf5_field(data, table, field_name):
+
+    return data.dtype.names[SCHEMA_STRINGS[table].split().index(field_name)]
+
+
+# Raises when a column narrowed by the write profile has values outside the range of its type, which would
+# otherwise be wrapped around or make the writer fail halfway through the import
+def check_narrowed(data, table, profile):
+
+    if(not profile or not len(data)):
+        return
+
+    for field_name, type_name in profile.get('types', {}).items():
+        if(field_name not in SCHEMA_STRINGS[table].split()):
+            continue
+        column = data[hdf5_field(data, table, field_name)]
+        limits = np.iinfo(ARROW_TYPES[type_name])
+        if(column.min() < limits.min or column.max() > limits.max):
+            raise RuntimeError("The values of " + table + "." + field_name + " are out of the range of " + type_name + ", the column can not be narrowed")
+
+
+# Builds an arrow table column by column from the structured array, no python objects are created per row
+def numpy_to_arrow(data, table, profile=None):
+
+    schema = arrow_schema(table, profile)
+    columns = []
+    for name, field in zip(data.dtype.names, schema):
+        columns.append(pa.array(data[name], type=field.type))
+
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+# Keyword arguments of the arrow Parquet writer for the write profile and row group size of a table
+# The writer of pyarrow 0.16, the last release for Python 2, has no column encodings, so delta needs the spark mode
+def arrow_write_options(table, options):
+
+    profile = profile_of(options)
+    if(profile.get('delta')):
+        raise RuntimeError("The arrow import mode can not delta encode the time columns, write profiles with delta need the spark mode")
+
+    kwargs = {'compression': profile.get('codec', 'snappy'), 'use_dictionary': profile.get('dictionary', True)}
+    if(options.get('row_group_size')):  # Given in bytes like parquet.block.size, arrow counts rows
+        kwargs['row_group_size'] = max(options['row_group_size'] // row_width(table, profile), 1)
+
+    return kwargs
+
+
+# The arrow counterpart of rollup_dataframe for one chunk, the counts of a bucket are spread over the chunks that hold it
+def rollup_chunk(data, table, options):
+
+    times = data[hdf5_field(data, table, TIME_FIELDS[table])]
+    keys = np.zeros(len(data), dtype=[('ob_id', '<i4'), ('timestamp', '<i8')])
+    keys['ob_id'] = data[hdf5_field(data, table, 'ob_id')]
+    keys['timestamp'] = times - times % options['granularity']
+    keys, counts = np.unique(keys, return_counts=True)
+
+    rollup = np.zeros(len(keys), dtype=[('ob_id', '<i4'), ('timestamp', '<i8'), ('count', '<i8')])
+    rollup['ob_id'] = keys['ob_id']
+    rollup['timestamp'] = keys['timestamp']
+    rollup['count'] = counts
+    return rollup
+
+
+def rollup_to_arrow(rollup):
+
+    return pa.Table.from_arrays([pa.array(rollup[name]) for name in rollup.dtype.names], names=list(rollup.dtype.names))
+
+
+# The values of the partition columns (day and/or ob_id) of the rows, the day from the time column
+def partition_values(data, partition_by, time_field, ob_id_field):
+
+    values = []
+    for column in partition_by or []:
+        if(column == 'day'):
+            values.append((column, data[time_field] // DAY_MS))
+        else:
+            values.append((column, data[ob_id_field]))
+    return values
+
+
+# The rows of every combination of the partition values as its hive style directory (day=N/ob_id=M) and the indexes
+# of its rows in their order. The partition columns are only in the directory names, as Spark writes them
+def partition_groups(values, rows):
+
+    if(not values):
+        yield '', np.arange(rows)
+        return
+
+    keys = np.zeros(rows, dtype=[(column, '<i8') for column, _ in values])
+    for column, column_values in values:
+        keys[column] = column_values
+    unique, inverse = np.unique(keys, return_inverse=True)
+
+    order = np.argsort(inverse, kind='mergesort')  # Stable, the rows of a partition keep the sort order of the chunk
+    bounds = np.cumsum(np.bincount(inverse))[:-1]
+    for key, indexes in zip(unique, np.split(order, bounds)):
+        yield '/'.join(column + '=' + str(key[column]) for column, _ in values), indexes
+
+
+# The legacy arrow filesystem of a file:// or hdfs:// dataset location (pyarrow.fs needs Python 3) and the path in it
+def arrow_filesystem(uri):
+
+    parsed = urlparse(uri)
+    if(parsed.scheme == 'hdfs'):
+        return pa.hdfs.connect(parsed.hostname, parsed.port), parsed.path
+    if(parsed.scheme in ('file', '')):
+        return pa.LocalFileSystem.get_instance(), parsed.path
+    raise RuntimeError("The arrow import mode can not write to " + uri)
+
+
+# Creates the directory and its parents, the tasks writing to the same partitions may create it at the same time
+def make_dir(filesystem, path):
+
+    try:
+        filesystem.mkdir(path)
+    except (OSError, IOError):
+        if(not filesystem.isdir(path)):
+            raise
+
+
+# Writes the arrow tables of the partitions of a chunk as part files of the dataset at the path
+def write_arrow_parts(filesystem, path, basename, groups, write_options):
+
+    for directory, arrow_table in groups:
+        partpath = path + '/' + directory if directory else path
+        make_dir(filesystem, partpath)
+        with filesystem.open(partpath + '/' + basename + '.parquet', 'wb') as part_file:
+            pq.write_table(arrow_table, part_file, **write_options)
+
+
+# Sorts a chunk by the sort columns of its table, the day column follows the time column
+def sort_chunk(data, table, options):
+
+    columns = [c for c in sort_columns(table, options) if c != 'day']
+    if(not columns):
+        return data
+
+    order = np.lexsort([data[hdf5_field(data, table, c)] for c in reversed(columns)])  # lexsort takes the primary key last
+    return data[order]
+
+
+# Reads the tables of one date group and writes every chunk of them as Parquet part files of its dataset
+def write_arrow_tables(x, originalpath, tablepaths, table_options, chunk_size=CHUNK_SIZE, tables=TABLES):
+
+    with h5py.File(originalpath) as f:
+        for table in tables:
+            data = f[str(x)].get(table)
+            options = table_options[table]
+            profile = profile_of(options)
+            write_options = arrow_write_options(table, options)
+
+            filesystem, tablepath = arrow_filesystem(tablepaths[table])
+            make_dir(filesystem, tablepath)
+            rollup = options.get('rollup')
+            if(rollup):
+                rollup_path = arrow_filesystem(rollup['tablepath'])[1]
+                make_dir(filesystem, rollup_path)
+
+            for index, chunk in enumerate(iter_hdf5_chunks(data, chunk_size)):
+                basename = 'part-' + str(x) + '-' + str(index)
+                check_narrowed(chunk, table, profile)
+                chunk = sort_chunk(chunk, table, options)
+                values = partition_values(chunk, options.get('partition_by'), hdf5_field(chunk, table, TIME_FIELDS[table]), hdf5_field(chunk, table, 'ob_id'))
+                groups = [(directory, numpy_to_arrow(chunk[indexes], table, profile)) for directory, indexes in partition_groups(values, len(chunk))]
+                write_arrow_parts(filesystem, tablepath, basename, groups, write_options)
+                if(rollup):
+                    counts = rollup_chunk(chunk, table, rollup)
+                    values = partition_values(counts, rollup['partition_by'], 'timestamp', 'ob_id')
+                    write_arrow_parts(filesystem, rollup_path, basename, [(directory, rollup_to_arrow(counts[indexes])) for directory, indexes in partition_groups(values, len(counts))], {})